@@ -0,0 +1,131 @@
+"""Benchmark the tracks queries before and after the schema migrations.
+
+Builds a throwaway database with ROWS tracked attractions, times the
+per-user and per-attraction queries the bot runs on the unindexed schema,
+applies the migrations and times them again, along with the single-
+statement upsert used by `/track_a_ride`.
+
+Run from the repository root with `python -m benchmarks.tracks`.
+"""
+
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+import helpers.migrations as migrations
+
+ROWS = 1_000_000
+USERS = 50_000
+ATTRACTIONS = 5_000
+SAMPLES = 50
+
+
+def populate(connection):
+    random.seed(0)
+
+    connection.executemany(
+        "INSERT INTO tracks (user_id, attraction_id, wait_threshold) "
+        "VALUES (?, ?, ?)",
+        (
+            (
+                i % USERS,
+                f"attraction-{random.randrange(ATTRACTIONS)}-{i // USERS}",
+                random.randrange(5, 120),
+            )
+            for i in range(ROWS)
+        ),
+    )
+    connection.commit()
+
+
+def sample_rows(connection):
+    return connection.execute(
+        "SELECT user_id, attraction_id FROM tracks "
+        "ORDER BY random() LIMIT ?",
+        (SAMPLES,),
+    ).fetchall()
+
+
+def timed(connection, sql, params):
+    start = time.perf_counter()
+
+    for args in params:
+        connection.execute(sql, args).fetchall()
+
+    return (time.perf_counter() - start) / len(params) * 1000
+
+
+def run_queries(connection, rows):
+    user_ids = [(user_id,) for user_id, _ in rows]
+    attraction_ids = [(attraction_id,) for _, attraction_id in rows]
+
+    return {
+        "get_user_tracks": timed(
+            connection, "SELECT * FROM tracks WHERE user_id = ?", user_ids
+        ),
+        "duplicate check": timed(
+            connection,
+            "SELECT * FROM tracks WHERE user_id = ? AND attraction_id = ?",
+            rows,
+        ),
+        "tracker update": timed(
+            connection,
+            "UPDATE tracks SET reached_threshold = 1 "
+            "WHERE user_id = ? AND attraction_id = ?",
+            rows,
+        ),
+        "rows by attraction": timed(
+            connection,
+            "SELECT * FROM tracks WHERE attraction_id = ?",
+            attraction_ids,
+        ),
+    }
+
+
+def main():
+    with tempfile.TemporaryDirectory() as directory:
+        connection = sqlite3.connect(os.path.join(directory, "bench.db"))
+        connection.execute("PRAGMA journal_mode = WAL")
+
+        # Only create the original tables so the first run is unindexed
+        for statement in migrations.MIGRATIONS[0]:
+            connection.execute(statement)
+        connection.execute("PRAGMA user_version = 1")
+
+        print(f"Populating {ROWS:,} tracks...", file=sys.stderr)
+        populate(connection)
+        rows = sample_rows(connection)
+
+        before = run_queries(connection, rows)
+
+        start = time.perf_counter()
+        connection.isolation_level = None
+        migrations.migrate(connection)
+        migration_time = time.perf_counter() - start
+
+        after = run_queries(connection, rows)
+
+        upsert = timed(
+            connection,
+            "INSERT INTO tracks (user_id, attraction_id, wait_threshold) "
+            "VALUES (?, ?, ?) "
+            "ON CONFLICT (user_id, attraction_id) DO UPDATE "
+            "SET wait_threshold = excluded.wait_threshold, "
+            "reached_threshold = 0",
+            [(user_id, attraction_id, 30) for user_id, attraction_id in rows],
+        )
+
+        connection.close()
+
+    print(f"Migrations applied in {migration_time:.2f} s\n")
+    print(f"{'query (ms per call)':<22}{'before':>12}{'after':>12}")
+    for name in before:
+        print(f"{name:<22}{before[name]:>12.3f}{after[name]:>12.3f}")
+    print(f"{'track upsert':<22}{'':>12}{upsert:>12.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -7,9 +7,18 @@ from discord import app_commands
 from dotenv import load_dotenv
 from discord.ext import commands
 import commands.attraction as attraction
+import commands.autocomplete as autocomplete
+import commands.channel as channel
 import commands.destination as destination
 #import commands.List as List
 #import commands.weather as weather
+import helpers.catalog as catalog
+import helpers.charts as charts
+import helpers.database as db
+import helpers.embed as embed
+import helpers.notifications as notifications
+import helpers.places as places
+import helpers.themeparks as themeparks
 import helpers.track_attractions as track_attractions
 
 logging.getLogger().setLevel(logging.INFO)
@@ -19,8 +28,39 @@ DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
 
 intents = discord.Intents.all()
 
-bot = commands.Bot(command_prefix="!", intents=intents,
-                   case_insensitive=False,)
+
+class ThemeBot(commands.Bot):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Only started by setup_hook, which never runs if logging in fails,
+        # while close() always runs
+        self.background_tasks = []
+
+    async def setup_hook(self):
+        await themeparks.open_session()
+
+        catalog.load()
+        notifications.start(self)
+        self.background_tasks = [
+            asyncio.create_task(themeparks.maintain_catalog()),
+            asyncio.create_task(track_attractions.run(self)),
+            asyncio.create_task(places.maintain()),
+        ]
+
+    async def close(self):
+        for task in self.background_tasks:
+            task.cancel()
+
+        await notifications.stop()
+        await super().close()
+        await themeparks.close_session()
+        await db.close()
+        charts.close()
+
+
+bot = ThemeBot(command_prefix="!", intents=intents,
+               case_insensitive=False,)
                    
                    
 #tree = app_commands.CommandTree(bot)
@@ -31,6 +71,10 @@ def main():
     bot.tree.add_command(track_a_ride)
     bot.tree.add_command(untrack_a_ride)
     bot.tree.add_command(view_tracked_rides)
+    #channels
+    bot.tree.add_command(track_a_ride_in_channel)
+    bot.tree.add_command(untrack_a_ride_in_channel)
+    bot.tree.add_command(view_channel_tracked_rides)
     #destinations
     bot.tree.add_command(add_destination)
     bot.tree.add_command(remove_destination)
@@ -47,11 +91,32 @@ async def on_ready():
     await bot.tree.sync()
     print(f"Logged in as {bot.user}!")
 
-    while True:
-        await track_attractions.track(bot)
-        await asyncio.sleep(5)
 
 
+@bot.tree.error
+async def on_app_command_error(interaction, error):
+    error = getattr(error, "original", error)
+
+    if isinstance(error, themeparks.ThemeParksError):
+        logging.warning("Command failed: %s", error)
+        message = (
+            "The ThemeParks API isn't responding right now.\n"
+            "Try again in a few minutes!"
+        )
+    else:
+        logging.error("Command failed", exc_info=error)
+        message = "Something went wrong. Try again in a few minutes!"
+
+    error_embed = embed.create_error_embed(message)
+
+    try:
+        if interaction.response.is_done():
+            await interaction.followup.send(embed=error_embed)
+        else:
+            await interaction.response.send_message(embed=error_embed)
+    except discord.HTTPException:
+        logging.exception("Failed to report a command error")
+
 
 @bot.command()
 async def sync(ctx):
@@ -85,6 +150,11 @@ async def sync(ctx):
 )
 @app_commands.allowed_installs(guilds=True, users=True) # users only, no guilds for install
 @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True) # all allowed
+@app_commands.autocomplete(
+    attraction_name=autocomplete.attraction_name,
+    park_name=autocomplete.park_name,
+    destination_name=autocomplete.destination_name,
+)
 async def ride_info(interaction, attraction_name: str, park_name: str = None, destination_name: str = None) -> None:
     await attraction.get(
         interaction, attraction_name, park_name, destination_name
@@ -100,6 +170,11 @@ async def clear_all_tracked_rides(interaction) -> None:
 @app_commands.command(description="Track an attraction.")
 @app_commands.allowed_installs(guilds=True, users=True) # users only, no guilds for install
 @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True) # all allowed
+@app_commands.autocomplete(
+    attraction_name=autocomplete.attraction_name,
+    park_name=autocomplete.park_name,
+    destination_name=autocomplete.destination_name,
+)
 async def track_a_ride(
     interaction,
     attraction_name: str,
@@ -120,6 +195,11 @@ async def track_a_ride(
 @app_commands.command(description="Untrack an attraction.")
 @app_commands.allowed_installs(guilds=True, users=True) # users only, no guilds for install
 @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True) # all allowed
+@app_commands.autocomplete(
+    attraction_name=autocomplete.attraction_name,
+    park_name=autocomplete.park_name,
+    destination_name=autocomplete.destination_name,
+)
 async def untrack_a_ride(
     interaction,
     attraction_name: str,
@@ -140,6 +220,61 @@ async def untrack_a_ride(
 @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True) # all allowed
 async def view_tracked_rides(interaction) -> None:
     await attraction.view_tracked(interaction)
+
+
+@app_commands.command(description="Post alerts for an attraction in this channel.")
+@app_commands.default_permissions(manage_channels=True)
+@app_commands.allowed_installs(guilds=True, users=False) # guilds only
+@app_commands.allowed_contexts(guilds=True, dms=False, private_channels=False) # guild channels only
+@app_commands.autocomplete(
+    attraction_name=autocomplete.any_attraction_name,
+    park_name=autocomplete.any_park_name,
+    destination_name=autocomplete.any_destination_name,
+)
+async def track_a_ride_in_channel(
+    interaction,
+    attraction_name: str,
+    wait_threshold: app_commands.Range[int, 0],
+    park_name: str = None,
+    destination_name: str = None
+) -> None:
+    await channel.track(
+        interaction,
+        attraction_name,
+        wait_threshold,
+        park_name,
+        destination_name,
+    )
+
+
+@app_commands.command(description="Stop posting alerts for an attraction in this channel.")
+@app_commands.default_permissions(manage_channels=True)
+@app_commands.allowed_installs(guilds=True, users=False) # guilds only
+@app_commands.allowed_contexts(guilds=True, dms=False, private_channels=False) # guild channels only
+@app_commands.autocomplete(
+    attraction_name=autocomplete.channel_attraction_name,
+    park_name=autocomplete.any_park_name,
+    destination_name=autocomplete.any_destination_name,
+)
+async def untrack_a_ride_in_channel(
+    interaction,
+    attraction_name: str,
+    park_name: str = None,
+    destination_name: str = None,
+) -> None:
+    await channel.untrack(
+        interaction,
+        attraction_name,
+        park_name,
+        destination_name,
+    )
+
+
+@app_commands.command(description="View the attractions tracked in this channel.")
+@app_commands.allowed_installs(guilds=True, users=False) # guilds only
+@app_commands.allowed_contexts(guilds=True, dms=False, private_channels=False) # guild channels only
+async def view_channel_tracked_rides(interaction) -> None:
+    await channel.view_tracked(interaction)
     
     
     
@@ -157,6 +292,7 @@ async def view_tracked_rides(interaction) -> None:
 )
 @app_commands.allowed_installs(guilds=True, users=True) # users only, no guilds for install
 @app_commands.allowed_contexts(guilds=True, dms=True, private_channels=True) # all allowed
+@app_commands.autocomplete(destination_name=autocomplete.any_destination_name)
 async def add_destination(interaction, destination_name: str) -> None:
     await destination.add(interaction, destination_name)
 
@@ -181,6 +317,7 @@ async def clear_all_your_destinations(interaction) -> None:
         "The destination to remove. Type all of part of the name."
     )
 )
+@app_commands.autocomplete(destination_name=autocomplete.destination_name)
 async def remove_destination(interaction, destination_name: str):
     await destination.remove(interaction, destination_name)
 
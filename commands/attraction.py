@@ -1,21 +1,21 @@
 import asyncio
 import io
+import logging
 
-import aiohttp
 import discord
-import matplotlib.pyplot as plt
-from dateutil import parser
 
+import helpers.charts as charts
 import helpers.database as db
 import helpers.decorators as decorators
 import helpers.embed as embed
+import helpers.places as places
 import helpers.themeparks as themeparks
 
 
 async def clear_tracked(interaction):
     await interaction.response.defer()
 
-    db.execute("DELETE FROM tracks WHERE user_id = ?", interaction.user.id)
+    await db.clear_user_tracks(interaction.user.id)
 
     success_embed = create_attractions_embed("Cleared tracked attractions!")
     add_no_attractions(success_embed)
@@ -23,399 +23,339 @@ async def clear_tracked(interaction):
     await interaction.followup.send(embed=success_embed)
 
 
+@decorators.within_deadline
 @decorators.require_destinations
 async def get(interaction, attraction_name, park_name, destination_name):
     #await interaction.response.defer()
 
-    destination_ids = db.get_user_destination_ids(interaction.user.id)
+    attraction = await find_attraction(
+        interaction, attraction_name, park_name, destination_name
+    )
+    if attraction is None:
+        return
 
-    async with aiohttp.ClientSession() as session:
-        attractions = await themeparks.search_for_entities(
-            session,
-            attraction_name,
-            destination_ids,
-            park_name,
-            destination_name,
-            "attraction",
-        )
+    attraction_id = attraction["id"]
 
-        if not await validate_attractions(
-            interaction, attractions, attraction_name
-        ):
-            return
+    # The park is looked up alongside the live data so that the reply only
+    # waits on the live data round trip
+    (live_attraction, age), park = await asyncio.gather(
+        themeparks.get_live_data_with_age(attraction_id),
+        get_park(attraction_id),
+    )
 
-        if len(attractions) > 1:
-            error_embed = embed.create_search_error_embed(
-                "Multiple attractions", attraction_name
-            )
+    live_data = live_attraction.get(attraction_id)
 
-            tasks = []
-            for i, attraction in enumerate(attractions):
-                tasks.append(
-                    asyncio.create_task(
-                        themeparks.get_entity(session, attraction["id"])
-                    )
-                )
+    if live_data is None:
+        error_embed = embed.create_error_embed(
+            f"No live data was found for `{attraction['name']}`."
+        )
 
-                if i >= embed.MAX_FIELDS - 1:
-                    break
+        return await interaction.followup.send(embed=error_embed)
 
-            entities = await asyncio.gather(*tasks)
-            await embed.add_addresses(error_embed, entities, session)
+    message_embed = create_live_embed(live_data, park)
 
-            return await interaction.followup.send(embed=error_embed)
+    if age is not None:
+        add_age(message_embed, age)
 
-        attraction_entity = await themeparks.get_entity(
-            session, attractions[0]["id"]
-        )
+    # TODO: Add return times if it exists for that attraction
 
-        attraction_task, park_task = (
-            asyncio.create_task(
-                themeparks.get_entity(session, attractions[0]["id"], "live")
-            ),
-            asyncio.create_task(
-                themeparks.get_entity(session, attraction_entity["parkId"])
-            ),
-        )
+    # We can maybe add notifications
+    # If a return time drops to within, say 1 hour of the current time
 
-        live_attraction, park = await attraction_task, await park_task
+    # TODO: Add operating hours if they exist
 
-    message_embed = embed.create_embed(live_attraction["name"], park["name"])
+    if not live_data.forecast:
+        return await interaction.followup.send(embed=message_embed)
 
-    live_data = live_attraction["liveData"][0]
+    # Reply with the live data right away, then attach the forecast chart
+    # once it has rendered
+    chart_task = asyncio.create_task(render_forecast(live_data.forecast))
 
-    if "queue" in live_data:
-        queue = live_data["queue"]
-        wait = queue["STANDBY"]["waitTime"]
-        has_queue = True
-    else:
-        wait = None
-        has_queue = False
+    message = await interaction.followup.send(embed=message_embed, wait=True)
 
-    message_embed.add_field(
-        name="Wait time",
-        value=f"`{wait}` minutes" if wait is not None else f"`{wait}`",
-    )
+    image = await chart_task
+    if image is None:
+        return
 
-    message_embed.add_field(name="Status", value=f"`{live_data['status']}`")
+    img_file = discord.File(io.BytesIO(image), filename="image.png")
 
-    if has_queue:
-        if "RETURN_TIME" in queue:
-            return_key = "RETURN_TIME"
-        elif "PAID_RETURN_TIME" in queue:
-            return_key = "PAID_RETURN_TIME"
-        else:
-            return_key = None
+    message_embed.set_image(url="attachment://image.png")
 
-        if return_key is not None:
-            return_data = queue[return_key]
+    await message.edit(embed=message_embed, attachments=[img_file])
 
-            state = return_data["state"]
 
-            if state == "AVAILABLE":
-                start = parser.parse(return_data["returnStart"])
-                return_string = f"`{start.hour}:{start.minute:02}`"
-            else:
-                return_string = f"`{state}`"
-
-            if "price" in return_data:
-                if state == "AVAILABLE":
-                    return_string = f"Time: {return_string}"
-
-                price = return_data["price"]
-                price_string = (
-                    "\nPrice: "
-                    f"`{(price['amount'] / 100):.2f} {price['currency']}`"
-                )
-            else:
-                price_string = ""
-
-            message_embed.add_field(
-                name="Return time",
-                value=return_string + price_string,
-                inline=False,
-            )
+@decorators.within_deadline
+@decorators.require_destinations
+async def track(
+    interaction, attraction_name, wait_threshold, park_name, destination_name
+):
+    #await interaction.response.defer()
 
-    if "operatingHours" in live_data:
-        for operation in live_data["operatingHours"]:
-            start = parser.parse(operation["startTime"])
-            end = parser.parse(operation["endTime"])
-
-            message_embed.add_field(
-                name=f"{operation['type']} hours",
-                value=(
-                    f"`{start.hour}:{start.minute:02}` "
-                    f"to `{end.hour}:{end.minute:02}`"
-                ),
-            )
+    current_tracks = await db.get_user_tracks(interaction.user.id)
 
-    # Adapted from
-    # https://www.geeksforgeeks.org/saving-a-plot-as-an-image-in-python/
-    if "forecast" in live_data:
-        hours = []
-        wait_times = []
+    if len(current_tracks) >= 25:
+        error_embed = embed.create_error_embed(
+            "You have reached the max number of "
+            "tracked attractions allowed (25).\n"
+            "Try removing some with `/attraction untrack`!"
+        )
 
-        plt.figure()
+        return await interaction.followup.send(embed=error_embed)
 
-        plt.title("Wait Forecast")
-        plt.xlabel("Hour")
-        plt.ylabel("Wait (minutes)")
+    attraction = await find_attraction(
+        interaction, attraction_name, park_name, destination_name
+    )
+    if attraction is None:
+        return
 
-        # https://stackoverflow.com/questions/10998621/rotate-axis-tick-labels
-        # plt.xticks(rotation=45, ha='right')
+    attraction_id = attraction["id"]
 
-        plt.grid()
+    place = await places.get_place(attraction_id)
 
-        for entry in live_data["forecast"]:
-            datetime = parser.parse(entry["time"])
+    await db.track_attraction(
+        interaction.user.id, attraction_id, wait_threshold, place
+    )
 
-            # hours.append(f"{datetime.hour}:{datetime.minute:02}")
-            hours.append(datetime.hour)
-            wait_times.append(entry["waitTime"])
+    success_embed = create_attractions_embed(f"Tracked {attraction['name']}!")
 
-        plt.plot(hours, wait_times)
+    tracks = await db.get_user_tracks(interaction.user.id)
+    await add_tracks(success_embed, tracks)
 
-        fig = plt.gcf()
+    await interaction.followup.send(embed=success_embed)
 
-        buf = io.BytesIO()
-        fig.savefig(buf)
-        buf.seek(0)
 
-        img_file = discord.File(buf, filename="image.png")
+@decorators.within_deadline
+@decorators.require_destinations
+async def untrack(interaction, attraction_name, park_name, destination_name):
+    #await interaction.response.defer()
 
-        message_embed.set_image(url="attachment://image.png")
+    destination_ids = await db.get_user_destination_ids(interaction.user.id)
 
-        return await interaction.followup.send(
-            file=img_file, embed=message_embed
-        )
+    attractions = await themeparks.search_for_entities(
+        attraction_name,
+        destination_ids,
+        park_name,
+        destination_name,
+        "attraction",
+    )
 
-    # TODO: Add return times if it exists for that attraction
+    tracks = await db.get_user_tracks(interaction.user.id)
 
-    # We can maybe add notifications
-    # If a return time drops to within, say 1 hour of the current time
+    matching_ids = []
+    matching_name = None
+    for attraction in attractions:
+        for row in tracks:
+            if attraction["id"] == row["attraction_id"]:
+                matching_ids.append(attraction["id"])
+                matching_name = attraction["name"]
+
+    if not await validate_attractions(
+        interaction, matching_ids, attraction_name
+    ):
+        return
+
+    if len(matching_ids) > 1:
+        error_embed = embed.create_search_error_embed(
+            "Multiple attractions", attraction_name
+        )
 
-    # TODO: Add operating hours if they exist
+        tasks = []
+        for match in matching_ids:
+            tasks.append(asyncio.create_task(themeparks.get_entity(match)))
 
-    await interaction.followup.send(embed=message_embed)
+        entities = await asyncio.gather(*tasks)
+        await embed.add_addresses(error_embed, entities)
 
+        return await interaction.followup.send(embed=error_embed)
 
-@decorators.require_destinations
-async def track(
-    interaction, attraction_name, wait_threshold, park_name, destination_name
-):
-    #await interaction.response.defer()
+    await db.untrack_attraction(interaction.user.id, matching_ids[0])
 
-    current_tracks = db.get_user_tracks(interaction.user.id)
+    success_embed = create_attractions_embed(f"Untracked {matching_name}!")
 
-    if len(current_tracks) >= 25:
-        error_embed = embed.create_error_embed(
-            "You have reached the max number of "
-            "tracked attractions allowed (25).\n"
-            "Try removing some with `/attraction untrack`!"
-        )
+    tracks = await db.get_user_tracks(interaction.user.id)
 
-        return await interaction.followup.send(embed=error_embed)
+    if tracks:
+        await add_tracks(success_embed, tracks)
+    else:
+        add_no_attractions(success_embed)
 
-    destination_ids = db.get_user_destination_ids(interaction.user.id)
+    await interaction.followup.send(embed=success_embed)
 
-    async with aiohttp.ClientSession() as session:
-        attractions = await themeparks.search_for_entities(
-            session,
-            attraction_name,
-            destination_ids,
-            park_name,
-            destination_name,
-            "attraction",
-        )
 
-        if not await validate_attractions(
-            interaction, attractions, attraction_name
-        ):
-            return
+@decorators.within_deadline
+async def view_tracked(interaction):
+    await interaction.response.defer()
 
-        if len(attractions) > 1:
-            error_embed = embed.create_search_error_embed(
-                "Multiple attractions", attraction_name
-            )
+    tracks = await db.get_user_tracks(interaction.user.id)
 
-            tasks = []
-            for i, attraction in enumerate(attractions):
-                tasks.append(
-                    asyncio.create_task(
-                        themeparks.get_entity(session, attraction["id"])
-                    )
-                )
+    message_embed = create_attractions_embed("Tracked attractions")
+
+    if tracks:
+        await add_tracks(message_embed, tracks)
+    else:
+        add_no_attractions(message_embed)
 
-                if i >= embed.MAX_FIELDS - 1:
-                    break
+    await interaction.followup.send(embed=message_embed)
 
-            entities = await asyncio.gather(*tasks)
-            await embed.add_addresses(error_embed, entities, session)
 
-            return await interaction.followup.send(embed=error_embed)
+async def find_attraction(
+    interaction,
+    attraction_name,
+    park_name,
+    destination_name,
+    all_destinations=False,
+):
+    """Search the user's destinations, or every one, for one attraction.
 
-        attraction_id = attractions[0]["id"]
+    Returns None after telling the user if none or several were found.
+    """
 
-        duplicates = db.execute(
-            "SELECT * FROM tracks "
-            "WHERE user_id = ? "
-            "AND attraction_id = ?",
-            interaction.user.id,
-            attraction_id,
+    if all_destinations:
+        destination_ids = None
+    else:
+        destination_ids = await db.get_user_destination_ids(
+            interaction.user.id
         )
 
-        if duplicates:
-            db.execute(
-                "UPDATE tracks "
-                "SET wait_threshold = ?, reached_threshold = 0 "
-                "WHERE user_id = ? "
-                "AND attraction_id = ?",
-                wait_threshold,
-                interaction.user.id,
-                attraction_id,
-            )
-        else:
-            db.execute(
-                "INSERT INTO tracks (user_id, attraction_id, wait_threshold) "
-                "VALUES (?, ?, ?)",
-                interaction.user.id,
-                attraction_id,
-                wait_threshold,
-            )
+    attractions = await themeparks.search_for_entities(
+        attraction_name,
+        destination_ids,
+        park_name,
+        destination_name,
+        "attraction",
+    )
 
-        success_embed = create_attractions_embed(
-            f"Tracked {attractions[0]['name']}!"
-        )
+    if not await validate_attractions(
+        interaction, attractions, attraction_name
+    ):
+        return None
 
-        tracks = db.get_user_tracks(interaction.user.id)
+    if len(attractions) > 1:
+        error_embed = embed.create_search_error_embed(
+            "Multiple attractions", attraction_name
+        )
 
         tasks = []
-        wait_thresholds = tuple(row["wait_threshold"] for row in tracks)
-        for row in tracks:
+        for i, attraction in enumerate(attractions):
             tasks.append(
-                asyncio.create_task(
-                    themeparks.get_entity(session, row["attraction_id"])
-                )
+                asyncio.create_task(themeparks.get_entity(attraction["id"]))
             )
 
+            if i >= embed.MAX_FIELDS - 1:
+                break
+
         entities = await asyncio.gather(*tasks)
+        await embed.add_addresses(error_embed, entities)
 
-        await embed.add_addresses(
-            success_embed, entities, session, wait_thresholds
-        )
+        await interaction.followup.send(embed=error_embed)
 
-    await interaction.followup.send(embed=success_embed)
+        return None
 
+    return attractions[0]
 
-@decorators.require_destinations
-async def untrack(interaction, attraction_name, park_name, destination_name):
-    #await interaction.response.defer()
 
-    destination_ids = db.get_user_destination_ids(interaction.user.id)
+async def add_tracks(message_embed, tracks):
+    await places.fill_missing("tracks", tracks)
 
-    async with aiohttp.ClientSession() as session:
-        attractions = await themeparks.search_for_entities(
-            session,
-            attraction_name,
-            destination_ids,
-            park_name,
-            destination_name,
-            "attraction",
-        )
+    embed.add_places(
+        message_embed, tracks, [row["wait_threshold"] for row in tracks]
+    )
 
-        tracks = db.get_user_tracks(interaction.user.id)
 
-        matching_ids = []
-        matching_name = None
-        for attraction in attractions:
-            for row in tracks:
-                if attraction["id"] == row["attraction_id"]:
-                    matching_ids.append(attraction["id"])
-                    matching_name = attraction["name"]
+async def get_park(attraction_id):
+    attraction_entity = await themeparks.get_entity(attraction_id)
 
-        if not await validate_attractions(
-            interaction, matching_ids, attraction_name
-        ):
-            return
+    return await themeparks.get_entity(attraction_entity["parkId"])
 
-        if len(matching_ids) > 1:
-            error_embed = embed.create_search_error_embed(
-                "Multiple attractions", attraction_name
-            )
 
-            tasks = []
-            for match in matching_ids:
-                tasks.append(
-                    asyncio.create_task(themeparks.get_entity(session, match))
-                )
+def create_live_embed(live_data, park):
+    message_embed = embed.create_embed(live_data.name, park["name"])
 
-            entities = await asyncio.gather(*tasks)
-            await embed.add_addresses(error_embed, entities, session)
+    wait = live_data.wait
 
-            return await interaction.followup.send(embed=error_embed)
+    message_embed.add_field(
+        name="Wait time",
+        value=f"`{wait}` minutes" if wait is not None else f"`{wait}`",
+    )
 
-        db.execute(
-            "DELETE FROM tracks " "WHERE user_id = ? " "AND attraction_id = ?",
-            interaction.user.id,
-            matching_ids[0],
-        )
+    message_embed.add_field(name="Status", value=f"`{live_data.status}`")
 
-        success_embed = create_attractions_embed(f"Untracked {matching_name}!")
+    return_time = live_data.return_time
 
-        tracks = db.get_user_tracks(interaction.user.id)
+    if return_time is not None:
+        state = return_time.state
 
-        if tracks:
-            tasks = []
-            wait_thresholds = tuple(row["wait_threshold"] for row in tracks)
-            for row in tracks:
-                tasks.append(
-                    asyncio.create_task(
-                        themeparks.get_entity(session, row["attraction_id"])
-                    )
-                )
+        if state == "AVAILABLE":
+            start = return_time.start
+            return_string = f"`{start.hour}:{start.minute:02}`"
+        else:
+            return_string = f"`{state}`"
 
-            entities = await asyncio.gather(*tasks)
+        if return_time.price is not None:
+            if state == "AVAILABLE":
+                return_string = f"Time: {return_string}"
 
-            await embed.add_addresses(
-                success_embed, entities, session, wait_thresholds
+            price_string = (
+                "\nPrice: "
+                f"`{(return_time.price / 100):.2f} {return_time.currency}`"
             )
         else:
-            add_no_attractions(success_embed)
+            price_string = ""
 
-    await interaction.followup.send(embed=success_embed)
+        message_embed.add_field(
+            name="Return time",
+            value=return_string + price_string,
+            inline=False,
+        )
 
+    for operation in live_data.operating_hours:
+        start = operation.start
+        end = operation.end
 
-async def view_tracked(interaction):
-    await interaction.response.defer()
+        message_embed.add_field(
+            name=f"{operation.type} hours",
+            value=(
+                f"`{start.hour}:{start.minute:02}` "
+                f"to `{end.hour}:{end.minute:02}`"
+            ),
+        )
 
-    tracks = db.get_user_tracks(interaction.user.id)
+    return message_embed
 
-    message_embed = create_attractions_embed("Tracked attractions")
 
-    if tracks:
-        tasks = []
+def add_age(embed, age):
+    minutes = max(1, round(age / 60))
 
-        thresholds = []
+    embed.set_footer(
+        text="The ThemeParks API isn't responding, so this is from "
+        f"{minutes} minute{'s' if minutes != 1 else ''} ago."
+    )
 
-        async with aiohttp.ClientSession() as session:
-            for row in tracks:
-                tasks.append(
-                    asyncio.create_task(
-                        themeparks.get_entity(session, row["attraction_id"])
-                    )
-                )
 
-                thresholds.append(row["wait_threshold"])
+async def render_forecast(forecast):
+    """Render a forecast chart, or get None if it can't be rendered.
 
-            entities = await asyncio.gather(*tasks)
+    The reply has usually been sent by then, so a failed chart is logged
+    and the reply left as it is.
+    """
 
-            await embed.add_addresses(
-                message_embed, entities, session, thresholds
-            )
-    else:
-        add_no_attractions(message_embed)
+    hours = []
+    wait_times = []
 
-    await interaction.followup.send(embed=message_embed)
+    for point in forecast:
+        # hours.append(f"{point.time.hour}:{point.time.minute:02}")
+        hours.append(point.time.hour)
+        wait_times.append(point.wait)
+
+    try:
+        return await charts.render_line_chart(
+            "Wait Forecast", "Hour", "Wait (minutes)", hours, wait_times
+        )
+    except charts.ChartsBusyError:
+        return None
+    except Exception:
+        logging.exception("Failed to render a forecast chart")
+        return None
 
 
 def add_no_attractions(embed):
@@ -0,0 +1,169 @@
+from discord import app_commands
+
+import helpers.catalog as catalog
+import helpers.database as db
+import helpers.search_index as search_index
+
+# Discord shows at most 25 choices, each at most 100 characters long
+MAX_CHOICES = 25
+MAX_CHOICE_LENGTH = 100
+
+# Autocomplete only reads the local catalog and database so that it always
+# answers within Discord's autocomplete window.
+
+
+async def attraction_name(interaction, current):
+    destinations = await get_search_destinations(interaction)
+
+    return suggest_attractions(interaction, destinations, current)
+
+
+async def any_attraction_name(interaction, current):
+    """Suggest from every destination, for channel tracks."""
+
+    destinations = get_typed_destinations(interaction)
+
+    return suggest_attractions(interaction, destinations, current)
+
+
+async def channel_attraction_name(interaction, current):
+    """Suggest from the attractions tracked in the channel."""
+
+    current = current.strip().lower()
+    tracks = await db.get_channel_tracks(interaction.channel_id)
+
+    return create_choices(
+        (f"{row['name']} ({row['park_name']})", row["name"])
+        for row in tracks
+        if row["name"] is not None and current in row["name"].lower()
+    )[:MAX_CHOICES]
+
+
+def suggest_attractions(interaction, destinations, current):
+    park_ids = get_park_ids(destinations, interaction.namespace.park_name)
+
+    suggestions = search_index.suggest_children(
+        destinations, current, MAX_CHOICES, park_ids, "ATTRACTION"
+    )
+
+    return create_choices(
+        (f"{child['name']} ({park['name']})", child["name"])
+        for child, park in suggestions
+    )
+
+
+async def park_name(interaction, current):
+    destinations = await get_search_destinations(interaction)
+
+    return suggest_parks(destinations, current)
+
+
+async def any_park_name(interaction, current):
+    """Suggest from every destination, for channel tracks."""
+
+    return suggest_parks(get_typed_destinations(interaction), current)
+
+
+def suggest_parks(destinations, current):
+    suggestions = search_index.suggest_parks(
+        destinations, current, MAX_CHOICES
+    )
+
+    return create_choices(
+        (f"{park['name']} ({destination['name']})", park["name"])
+        for park, destination in suggestions
+    )
+
+
+async def destination_name(interaction, current):
+    """Suggest from the destinations the user has added."""
+
+    destinations = catalog.get_destinations() or []
+    destination_ids = set(
+        await db.get_user_destination_ids(interaction.user.id)
+    )
+
+    suggestions = search_index.suggest_destinations(
+        destinations, current, MAX_CHOICES, destination_ids
+    )
+
+    return create_choices(
+        (destination["name"], destination["name"])
+        for destination in suggestions
+    )
+
+
+async def any_destination_name(interaction, current):
+    """Suggest from every destination, for adding new ones."""
+
+    destinations = catalog.get_destinations() or []
+
+    suggestions = search_index.suggest_destinations(
+        destinations, current, MAX_CHOICES
+    )
+
+    return create_choices(
+        (destination["name"], destination["name"])
+        for destination in suggestions
+    )
+
+
+async def get_search_destinations(interaction):
+    """Get the user's destinations, narrowed by a typed destination name."""
+
+    destination_ids = set(
+        await db.get_user_destination_ids(interaction.user.id)
+    )
+
+    return [
+        destination
+        for destination in get_typed_destinations(interaction)
+        if destination["id"] in destination_ids
+    ]
+
+
+def get_typed_destinations(interaction):
+    """Get every destination, narrowed by a typed destination name."""
+
+    destinations = catalog.get_destinations() or []
+
+    destination_query = interaction.namespace.destination_name
+    if destination_query:
+        destinations = search_index.search_destinations(
+            destinations, destination_query
+        )
+
+    return destinations
+
+
+def get_park_ids(destinations, park_query):
+    if not park_query:
+        return None
+
+    park_ids = set()
+    for destination in destinations:
+        index = search_index.get_destination_index(destination)
+
+        for park in index.search_parks(park_query):
+            park_ids.add(park["id"])
+
+    return park_ids
+
+
+def create_choices(labels_and_values):
+    choices = []
+    seen = set()
+
+    for label, value in labels_and_values:
+        if label in seen:
+            continue
+
+        seen.add(label)
+        choices.append(
+            app_commands.Choice(
+                name=label[:MAX_CHOICE_LENGTH],
+                value=value[:MAX_CHOICE_LENGTH],
+            )
+        )
+
+    return choices
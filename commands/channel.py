@@ -0,0 +1,152 @@
+import commands.attraction as attraction
+import helpers.database as db
+import helpers.decorators as decorators
+import helpers.embed as embed
+import helpers.places as places
+
+# Channel subscriptions post one alert per attraction to the channel, no
+# matter how many members are watching it
+MAX_CHANNEL_TRACKS = 25
+
+
+@decorators.within_deadline
+async def track(
+    interaction, attraction_name, wait_threshold, park_name, destination_name
+):
+    await interaction.response.defer()
+
+    current_tracks = await db.get_channel_tracks(interaction.channel_id)
+
+    if len(current_tracks) >= MAX_CHANNEL_TRACKS:
+        error_embed = embed.create_error_embed(
+            "This channel has reached the max number of "
+            f"tracked attractions allowed ({MAX_CHANNEL_TRACKS}).\n"
+            "Try removing some with `/untrack_a_ride_in_channel`!"
+        )
+
+        return await interaction.followup.send(embed=error_embed)
+
+    # Searched across every destination, since channel tracks are shared
+    # rather than tied to the destinations whoever runs this has added
+    found = await attraction.find_attraction(
+        interaction,
+        attraction_name,
+        park_name,
+        destination_name,
+        all_destinations=True,
+    )
+    if found is None:
+        return
+
+    place = await places.get_place(found["id"])
+
+    await db.track_attraction_in_channel(
+        interaction.guild_id,
+        interaction.channel_id,
+        found["id"],
+        wait_threshold,
+        place,
+    )
+
+    success_embed = create_channel_embed(f"Tracked {found['name']}!")
+
+    tracks = await db.get_channel_tracks(interaction.channel_id)
+    await add_tracks(success_embed, tracks)
+
+    await interaction.followup.send(embed=success_embed)
+
+
+@decorators.within_deadline
+async def untrack(interaction, attraction_name, park_name, destination_name):
+    await interaction.response.defer()
+
+    tracks = await db.get_channel_tracks(interaction.channel_id)
+    await places.fill_missing("channel_tracks", tracks)
+
+    matches = []
+    remaining_tracks = []
+
+    for row in tracks:
+        if (
+            matches_name(row["name"], attraction_name)
+            and matches_name(row["park_name"], park_name)
+            and matches_name(row["destination_name"], destination_name)
+        ):
+            matches.append(row)
+        else:
+            remaining_tracks.append(row)
+
+    if not await attraction.validate_attractions(
+        interaction, matches, attraction_name
+    ):
+        return
+
+    if len(matches) > 1:
+        error_embed = embed.create_search_error_embed(
+            "Multiple attractions", attraction_name
+        )
+        add_places(error_embed, matches)
+
+        return await interaction.followup.send(embed=error_embed)
+
+    (row,) = matches
+
+    await db.untrack_attraction_in_channel(
+        interaction.channel_id, row["attraction_id"]
+    )
+
+    success_embed = create_channel_embed(f"Untracked {row['name']}!")
+
+    if remaining_tracks:
+        add_places(success_embed, remaining_tracks)
+    else:
+        add_no_attractions(success_embed)
+
+    await interaction.followup.send(embed=success_embed)
+
+
+@decorators.within_deadline
+async def view_tracked(interaction):
+    await interaction.response.defer()
+
+    tracks = await db.get_channel_tracks(interaction.channel_id)
+
+    message_embed = create_channel_embed("Channel tracked attractions")
+
+    if tracks:
+        await add_tracks(message_embed, tracks)
+    else:
+        add_no_attractions(message_embed)
+
+    await interaction.followup.send(embed=message_embed)
+
+
+async def add_tracks(message_embed, tracks):
+    await places.fill_missing("channel_tracks", tracks)
+
+    add_places(message_embed, tracks)
+
+
+def add_places(message_embed, tracks):
+    embed.add_places(
+        message_embed, tracks, [row["wait_threshold"] for row in tracks]
+    )
+
+
+def matches_name(name, query):
+    """Check a stored name against part of a name, where one was given."""
+
+    if not query:
+        return True
+
+    return query.strip().lower() in (name or "").lower()
+
+
+def add_no_attractions(embed):
+    embed.add_field(name="This channel has no tracked attractions.", value="")
+
+
+def create_channel_embed(title):
+    return embed.create_embed(
+        title, "Here are the attractions tracked in this channel."
+    )
@@ -1,16 +1,19 @@
 import asyncio
 
-import aiohttp
-
 import helpers.database as db
+import helpers.decorators as decorators
 import helpers.embed as embed
+import helpers.places as places
 import helpers.themeparks as themeparks
 
 
+@decorators.within_deadline
 async def add(interaction, destination_name):
     await interaction.response.defer()
 
-    current_destination_ids = db.get_user_destination_ids(interaction.user.id)
+    current_destination_ids = await db.get_user_destination_ids(
+        interaction.user.id
+    )
 
     if len(current_destination_ids) >= 25:
         error_embed = embed.create_error_embed(
@@ -20,79 +23,53 @@ async def add(interaction, destination_name):
 
         return await interaction.followup.send(embed=error_embed)
 
-    async with aiohttp.ClientSession() as session:
-        destinations = await themeparks.search_for_destinations(
-            session, destination_name
-        )
-
-        if not await validate_destinations(
-            interaction, destinations, destination_name
-        ):
-            return
-
-        if len(destinations) > 1:
-            error_embed = embed.create_search_error_embed(
-                "Multiple destinations", destination_name
-            )
-
-            tasks = []
-            for i, destination in enumerate(destinations):
-                tasks.append(
-                    asyncio.create_task(
-                        themeparks.get_entity(session, destination["id"])
-                    )
-                )
+    destinations = await themeparks.search_for_destinations(destination_name)
 
-                if i >= embed.MAX_FIELDS - 1:
-                    break
+    if not await validate_destinations(
+        interaction, destinations, destination_name
+    ):
+        return
 
-            entities = await asyncio.gather(*tasks)
-            await embed.add_addresses(error_embed, entities, session)
+    if len(destinations) > 1:
+        error_embed = embed.create_search_error_embed(
+            "Multiple destinations", destination_name
+        )
 
-            return await interaction.followup.send(embed=error_embed)
+        tasks = []
+        for i, destination in enumerate(destinations):
+            tasks.append(
+                asyncio.create_task(themeparks.get_entity(destination["id"]))
+            )
 
-        destination_id = destinations[0]["id"]
+            if i >= embed.MAX_FIELDS - 1:
+                break
 
-        duplicate_destinations = db.execute(
-            "SELECT * FROM destinations "
-            "WHERE user_id = ? "
-            "AND destination_id = ?",
-            interaction.user.id,
-            destination_id,
-        )
+        entities = await asyncio.gather(*tasks)
+        await embed.add_addresses(error_embed, entities)
 
-        if duplicate_destinations:
-            error_embed = embed.create_error_embed(
-                f"`{destinations[0]['name']}` "
-                "is already in your list of destinations!"
-            )
+        return await interaction.followup.send(embed=error_embed)
 
-            return await interaction.followup.send(embed=error_embed)
+    destination_id = destinations[0]["id"]
 
-        db.execute(
-            "INSERT INTO destinations (user_id, destination_id) "
-            "VALUES (?, ?)",
-            interaction.user.id,
-            destination_id,
+    if destination_id in current_destination_ids:
+        error_embed = embed.create_error_embed(
+            f"`{destinations[0]['name']}` "
+            "is already in your list of destinations!"
         )
 
-        success_embed = create_destinations_embed(
-            f"Added {destinations[0]['name']}!"
-        )
+        return await interaction.followup.send(embed=error_embed)
 
-        current_destination_ids = db.get_user_destination_ids(
-            interaction.user.id
-        )
+    place = await places.get_place(destination_id)
 
-        tasks = []
-        for id in current_destination_ids:
-            tasks.append(
-                asyncio.create_task(themeparks.get_entity(session, id))
-            )
+    await db.add_user_destination(interaction.user.id, destination_id, place)
 
-        entities = await asyncio.gather(*tasks)
+    success_embed = create_destinations_embed(
+        f"Added {destinations[0]['name']}!"
+    )
 
-        await embed.add_addresses(success_embed, entities, session)
+    await add_destinations(
+        success_embed, await db.get_user_destinations(interaction.user.id)
+    )
 
     await interaction.followup.send(embed=success_embed)
 
@@ -100,9 +77,7 @@ async def add(interaction, destination_name):
 async def clear_added(interaction):
     await interaction.response.defer()
 
-    db.execute(
-        "DELETE FROM destinations WHERE user_id = ?", interaction.user.id
-    )
+    await db.clear_user_destinations(interaction.user.id)
 
     success_embed = create_destinations_embed("Destinations cleared!")
     add_no_destinations(success_embed)
@@ -110,91 +85,72 @@ async def clear_added(interaction):
     await interaction.followup.send(embed=success_embed)
 
 
+@decorators.within_deadline
 async def remove(interaction, destination_name):
     await interaction.response.defer()
 
-    current_destination_ids = db.get_user_destination_ids(interaction.user.id)
+    current_destinations = await db.get_user_destinations(interaction.user.id)
+    await places.fill_missing("destinations", current_destinations)
 
     destination_name = destination_name.strip().lower()
 
     matches = []
-    remaining_entities = []
+    remaining_destinations = []
 
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        for id in current_destination_ids:
-            tasks.append(
-                asyncio.create_task(themeparks.get_entity(session, id))
-            )
+    for row in current_destinations:
+        if destination_name in (row["name"] or "").lower():
+            matches.append(row)
+        else:
+            remaining_destinations.append(row)
 
-        entities = await asyncio.gather(*tasks)
-        for entity in entities:
-            if destination_name in entity["name"].lower():
-                matches.append(entity)
-            else:
-                remaining_entities.append(entity)
-
-        if not await validate_destinations(
-            interaction, matches, destination_name
-        ):
-            return
-
-        if len(matches) > 1:
-            error_embed = embed.create_search_error_embed(
-                "Multiple destinations", destination_name
-            )
+    if not await validate_destinations(interaction, matches, destination_name):
+        return
 
-            await embed.add_addresses(error_embed, matches, session)
+    if len(matches) > 1:
+        error_embed = embed.create_search_error_embed(
+            "Multiple destinations", destination_name
+        )
 
-            return await interaction.followup.send(embed=error_embed)
+        embed.add_places(error_embed, matches)
 
-        db.execute(
-            "DELETE FROM destinations "
-            "WHERE user_id = ? "
-            "AND destination_id = ?",
-            interaction.user.id,
-            matches[0]["id"],
-        )
+        return await interaction.followup.send(embed=error_embed)
 
-        success_embed = create_destinations_embed(
-            f"Removed {matches[0]['name']}!"
-        )
+    await db.remove_user_destination(
+        interaction.user.id, matches[0]["destination_id"]
+    )
 
-        if remaining_entities:
-            await embed.add_addresses(
-                success_embed, remaining_entities, session
-            )
-        else:
-            add_no_destinations(success_embed)
+    success_embed = create_destinations_embed(f"Removed {matches[0]['name']}!")
+
+    if remaining_destinations:
+        embed.add_places(success_embed, remaining_destinations)
+    else:
+        add_no_destinations(success_embed)
 
     await interaction.followup.send(embed=success_embed)
 
 
+@decorators.within_deadline
 async def view_added(interaction):
     await interaction.response.defer()
 
-    current_destination_ids = db.get_user_destination_ids(interaction.user.id)
+    current_destinations = await db.get_user_destinations(interaction.user.id)
 
     message_embed = create_destinations_embed("Destinations")
 
-    if current_destination_ids:
-        tasks = []
-
-        async with aiohttp.ClientSession() as session:
-            for id in current_destination_ids:
-                tasks.append(
-                    asyncio.create_task(themeparks.get_entity(session, id))
-                )
-
-            entities = await asyncio.gather(*tasks)
-
-        await embed.add_addresses(message_embed, entities, session)
+    if current_destinations:
+        await add_destinations(message_embed, current_destinations)
     else:
         add_no_destinations(message_embed)
 
     await interaction.followup.send(embed=message_embed)
 
 
+async def add_destinations(message_embed, destinations):
+    await places.fill_missing("destinations", destinations)
+
+    embed.add_places(message_embed, destinations)
+
+
 def add_no_destinations(embed):
     embed.add_field(name="You have no added destinations.", value="")
 
@@ -0,0 +1,134 @@
+import time
+from collections import OrderedDict
+
+
+class TTLCache:
+    """In-memory LRU cache whose entries expire after a per-entry TTL.
+
+    The cache is bounded both by number of entries and by the approximate
+    size of the stored values, evicting the least recently used entries
+    first once either limit is exceeded. Expired entries are kept for a
+    further stale_ttl seconds, for get_stale to fall back on.
+    """
+
+    def __init__(self, max_entries, max_bytes=None, stale_ttl=0):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stale_ttl = stale_ttl
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return self._lookup(key) is not None
+
+    def get(self, key, default=None):
+        entry = self._lookup(key)
+
+        if entry is None:
+            self.misses += 1
+            return default
+
+        self.hits += 1
+        self._entries.move_to_end(key)
+
+        return entry[0]
+
+    def set(self, key, value, ttl, size=0):
+        self.pop(key)
+
+        now = time.monotonic()
+        self._entries[key] = (value, now + ttl, size, now)
+        self._bytes += size
+
+        self._evict()
+
+    def pop(self, key):
+        entry = self._entries.pop(key, None)
+
+        if entry is None:
+            return None
+
+        self._bytes -= entry[2]
+        return entry[0]
+
+    def clear(self):
+        self._entries.clear()
+        self._bytes = 0
+
+    def items(self):
+        """Get the unexpired (key, value) pairs without touching LRU order."""
+
+        now = time.monotonic()
+
+        return [
+            (key, value)
+            for key, (value, expires_at, _, _) in self._entries.items()
+            if expires_at > now
+        ]
+
+    def get_stale(self, key):
+        """Get a value and its age in seconds, even if it has expired.
+
+        Returns None once the value is past its stale_ttl.
+        """
+
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return None
+
+        value, expires_at, _, stored_at = entry
+        now = time.monotonic()
+
+        if expires_at + self.stale_ttl <= now:
+            self.pop(key)
+            return None
+
+        return value, now - stored_at
+
+    def stats(self):
+        lookups = self.hits + self.misses
+
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+
+        if entry is None:
+            return None
+
+        expires_at = entry[1]
+        now = time.monotonic()
+
+        if expires_at <= now:
+            if expires_at + self.stale_ttl <= now:
+                self.pop(key)
+
+            return None
+
+        return entry
+
+    def _evict(self):
+        while len(self._entries) > self.max_entries or (
+            self.max_bytes is not None
+            and self._bytes > self.max_bytes
+            and len(self._entries) > 1
+        ):
+            _, (_, _, size, _) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
@@ -0,0 +1,141 @@
+import json
+import os
+import time
+
+# Local snapshot of the destination -> park -> children hierarchy,
+# stored next to themeparkify.db
+CATALOG_PATH = "catalog.json"
+CATALOG_FORMAT = 1
+
+_destinations = None
+_destinations_updated = 0
+_children = {}
+
+
+def load(path=CATALOG_PATH):
+    """Load the catalog snapshot from disk.
+
+    Returns whether a snapshot was loaded.
+    """
+
+    global _destinations, _destinations_updated, _children
+
+    try:
+        with open(path, encoding="utf-8") as file:
+            data = json.load(file)
+    except (OSError, ValueError):
+        return False
+
+    if data.get("format") != CATALOG_FORMAT:
+        return False
+
+    _destinations = data["destinations"]
+    _destinations_updated = data["destinations_updated"]
+    _children = data["children"]
+
+    return True
+
+
+def snapshot():
+    """Get a copy of the catalog that is safe to serialize off the loop."""
+
+    return {
+        "format": CATALOG_FORMAT,
+        "destinations": _destinations,
+        "destinations_updated": _destinations_updated,
+        "children": dict(_children),
+    }
+
+
+def save(data, path=CATALOG_PATH):
+    """Atomically write a catalog snapshot to disk."""
+
+    temp_path = f"{path}.tmp"
+
+    with open(temp_path, "w", encoding="utf-8") as file:
+        json.dump(data, file, separators=(",", ":"))
+
+    os.replace(temp_path, path)
+
+
+def get_destinations():
+    """Get all destinations, or None if the catalog has none yet."""
+
+    return _destinations
+
+
+def set_destinations(destinations):
+    """Replace the destination list and forget parks that no longer exist."""
+
+    global _destinations, _destinations_updated, _children
+
+    _destinations = destinations
+    _destinations_updated = time.time()
+
+    park_ids = get_park_ids()
+    _children = {
+        park_id: entry
+        for park_id, entry in _children.items()
+        if park_id in park_ids
+    }
+
+
+def get_park_ids():
+    park_ids = set()
+
+    for destination in _destinations or ():
+        for park in destination["parks"]:
+            park_ids.add(park["id"])
+
+    return park_ids
+
+
+def get_children(park_id):
+    """Get the children of a park, or None if they aren't in the catalog."""
+
+    entry = _children.get(park_id)
+
+    if entry is None:
+        return None
+
+    return entry["children"]
+
+
+def get_children_updated(park_id):
+    entry = _children.get(park_id)
+
+    if entry is None:
+        return None
+
+    return entry["updated"]
+
+
+def set_children(park_id, children):
+    _children[park_id] = {"updated": time.time(), "children": children}
+
+
+def destinations_age():
+    return time.time() - _destinations_updated
+
+
+def get_stale_park_ids(max_age):
+    """Get the IDs of parks whose children are missing or too old.
+
+    Parks that have never been fetched come first, then the oldest.
+    """
+
+    now = time.time()
+    updated = {}
+
+    for park_id in get_park_ids():
+        entry = _children.get(park_id)
+        updated[park_id] = 0 if entry is None else entry["updated"]
+
+    return sorted(
+        (
+            park_id
+            for park_id, timestamp in updated.items()
+            if now - timestamp > max_age
+        ),
+        key=updated.get,
+    )
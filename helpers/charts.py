@@ -0,0 +1,222 @@
+import asyncio
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+from helpers.cache import TTLCache
+from helpers.singleflight import SingleFlight
+
+# Charts render in worker processes so they never block the event loop
+CHART_WORKERS = int(os.getenv("CHART_WORKERS", 2))
+# Charts waiting or rendering at once before new ones are turned away
+CHART_QUEUE_SIZE = int(os.getenv("CHART_QUEUE_SIZE", 32))
+
+# Rendered charts are cached by a hash of everything drawn on them
+CHART_CACHE_TTL = 24 * 60 * 60
+CHART_CACHE_MAX_ENTRIES = int(os.getenv("CHART_CACHE_MAX_ENTRIES", 1000))
+CHART_CACHE_MAX_BYTES = int(
+    os.getenv("CHART_CACHE_MAX_BYTES", 32 * 1024 * 1024)
+)
+# Optional directory charts are also saved to, so they outlive eviction
+# and restarts. Files are named by their hash, so it can be cleared freely.
+# The least recently used files are deleted once it grows past its cap.
+CHART_CACHE_DIR = os.getenv("CHART_CACHE_DIR")
+CHART_CACHE_DIR_MAX_BYTES = int(
+    os.getenv("CHART_CACHE_DIR_MAX_BYTES", 256 * 1024 * 1024)
+)
+
+_executor = None
+_pending = 0
+_rendering = SingleFlight()
+
+chart_cache = TTLCache(CHART_CACHE_MAX_ENTRIES, CHART_CACHE_MAX_BYTES)
+
+
+class ChartsBusyError(Exception):
+    """Raised when too many charts are already waiting to render."""
+
+
+async def render_line_chart(title, xlabel, ylabel, x, y):
+    """Render a line chart off the event loop and return it as PNG bytes.
+
+    Identical charts are rendered once and then served from the cache,
+    and concurrent requests for the same chart share one render.
+    """
+
+    key = get_chart_key("line", title, xlabel, ylabel, x, y)
+
+    image = chart_cache.get(key)
+    if image is not None:
+        return image
+
+    return await _rendering.run(
+        key,
+        lambda: _get_chart(
+            key, _render_line_chart, title, xlabel, ylabel, x, y
+        ),
+    )
+
+
+def get_chart_key(*chart):
+    return hashlib.sha256(repr(chart).encode()).hexdigest()
+
+
+def close():
+    global _executor
+
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+async def _get_chart(key, render, *args):
+    image = await _load_spilled(key)
+
+    if image is None:
+        image = await _render(render, *args)
+        await _spill(key, image)
+
+    chart_cache.set(key, image, CHART_CACHE_TTL, len(image))
+
+    return image
+
+
+async def _render(render, *args):
+    global _pending
+
+    if _pending >= CHART_QUEUE_SIZE:
+        raise ChartsBusyError(f"{_pending} charts are already rendering")
+
+    _pending += 1
+
+    try:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), render, *args)
+    finally:
+        _pending -= 1
+
+
+async def _load_spilled(key):
+    if CHART_CACHE_DIR is None:
+        return None
+
+    try:
+        return await asyncio.to_thread(_read_file, _get_spill_path(key))
+    except FileNotFoundError:
+        return None
+    except OSError:
+        logging.exception("Failed to read cached chart %s", key)
+        return None
+
+
+async def _spill(key, image):
+    if CHART_CACHE_DIR is None:
+        return
+
+    try:
+        await asyncio.to_thread(_write_file, _get_spill_path(key), image)
+        await asyncio.to_thread(_prune_spilled)
+    except OSError:
+        logging.exception("Failed to save chart %s", key)
+
+
+def _get_spill_path(key):
+    return os.path.join(CHART_CACHE_DIR, f"{key}.png")
+
+
+def _read_file(path):
+    with open(path, "rb") as file:
+        data = file.read()
+
+    # Marks the file as recently used, so pruning keeps it
+    os.utime(path)
+
+    return data
+
+
+def _write_file(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Written under a temporary name so readers never see a partial file
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as file:
+        file.write(data)
+
+    os.replace(temp_path, path)
+
+
+def _prune_spilled():
+    """Delete the least recently used charts once over the size cap."""
+
+    files = []
+    total = 0
+
+    with os.scandir(CHART_CACHE_DIR) as entries:
+        for entry in entries:
+            if not entry.name.endswith(".png"):
+                continue
+
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+    files.sort()
+
+    for _, size, path in files:
+        if total <= CHART_CACHE_DIR_MAX_BYTES:
+            break
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+        total -= size
+
+
+def _get_executor():
+    global _executor
+
+    if _executor is None:
+        _executor = ProcessPoolExecutor(
+            max_workers=CHART_WORKERS,
+            mp_context=multiprocessing.get_context("spawn"),
+        )
+
+    return _executor
+
+
+# Adapted from
+# https://www.geeksforgeeks.org/saving-a-plot-as-an-image-in-python/
+def _render_line_chart(title, xlabel, ylabel, x, y):
+    # Figures made without pyplot aren't tracked globally, so each one is
+    # freed once rendered instead of piling up in the pyplot registry
+    figure = Figure()
+    FigureCanvasAgg(figure)
+
+    try:
+        axes = figure.add_subplot()
+
+        axes.set_title(title)
+        axes.set_xlabel(xlabel)
+        axes.set_ylabel(ylabel)
+        axes.grid()
+
+        axes.plot(x, y)
+
+        buffer = io.BytesIO()
+        figure.savefig(buffer, format="png")
+
+        return buffer.getvalue()
+    finally:
+        figure.clear()
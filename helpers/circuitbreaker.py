@@ -0,0 +1,52 @@
+import time
+
+
+class CircuitBreaker:
+    """Stops calls to a failing service until it has had time to recover.
+
+    After failure_threshold failures in a row the circuit opens and
+    allow() turns calls away. Once reset_timeout seconds pass, one call is
+    let through as a probe: success closes the circuit and failure keeps it
+    open for another reset_timeout.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+
+        self.failures = 0
+        self.opened = 0
+
+        self._opened_at = None
+
+    @property
+    def is_open(self):
+        return self._opened_at is not None
+
+    def allow(self):
+        """Check whether a call may go ahead, letting through probes."""
+
+        if self._opened_at is None:
+            return True
+
+        now = time.monotonic()
+
+        if now - self._opened_at < self.reset_timeout:
+            return False
+
+        # Only one probe per reset_timeout, even if it never reports back
+        self._opened_at = now
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self._opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+
+        if self._opened_at is not None:
+            self._opened_at = time.monotonic()
+        elif self.failures >= self.failure_threshold:
+            self._opened_at = time.monotonic()
+            self.opened += 1
@@ -1,21 +1,408 @@
-from cs50 import SQL
+import asyncio
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
 
-db = SQL("sqlite:///themeparkify.db")
+import helpers.migrations as migrations
+from helpers.cache import TTLCache
 
+DATABASE_PATH = "themeparkify.db"
+# Number of compiled statements SQLite keeps for reuse
+STATEMENT_CACHE_SIZE = 256
+BUSY_TIMEOUT = 5000
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", 10_000))
+USER_CACHE_TTL = 60 * 60
 
-def execute(sql, *args, **kwargs):
-    return db.execute(sql, *args, **kwargs)
+# ID column and stored place columns of each table with display metadata
+PLACE_COLUMNS = {
+    "tracks": (
+        "attraction_id",
+        ("name", "park_name", "destination_name", "latitude", "longitude"),
+    ),
+    "destinations": ("destination_id", ("name", "latitude", "longitude")),
+    "channel_tracks": (
+        "attraction_id",
+        ("name", "park_name", "destination_name", "latitude", "longitude"),
+    ),
+}
 
+# SQLite runs on one dedicated thread so that queries never block the
+# event loop and the connection is only ever used from that thread
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="database")
+_connection = None
 
-def get_user_destination_ids(user_id):
-    destination_ids = []
+# Each user's destination IDs and track rows, keyed by ("destinations",
+# user_id) and ("tracks", user_id). Every write to those tables goes through
+# the functions below, which keep the cached copies in step.
+user_cache = TTLCache(USER_CACHE_MAX_ENTRIES)
+# Bumped on every user write so a load that raced a write isn't cached
+_writes = 0
 
-    rows = execute("SELECT * FROM destinations WHERE user_id = ?", user_id)
-    for row in rows:
-        destination_ids.append(row["destination_id"])
 
-    return destination_ids
+async def execute(sql, *args):
+    """Execute a SQL statement without blocking the event loop.
 
+    Returns a list of dict rows for queries, the new row's ID for inserts
+    and the number of affected rows for other statements.
+    """
 
-def get_user_tracks(user_id):
-    return db.execute("SELECT * FROM tracks WHERE user_id = ?", user_id)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, _execute, sql, args)
+
+
+async def execute_many(sql, params):
+    """Execute a SQL statement once per set of parameters.
+
+    All executions share one transaction, so they are committed together
+    with a single sync to disk. Returns the number of affected rows.
+    """
+
+    return await execute_batch([(sql, params)])
+
+
+async def execute_batch(statements):
+    """Execute each (sql, params) statement once per set of parameters.
+
+    Like execute_many, but every statement shares the one transaction.
+    Returns the total number of affected rows.
+    """
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _executor,
+        _execute_many,
+        [(sql, list(params)) for sql, params in statements],
+    )
+
+
+async def close():
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(_executor, _close)
+
+
+async def get_user_destinations(user_id):
+    return await _load_user(
+        "destinations",
+        user_id,
+        "SELECT * FROM destinations WHERE user_id = ? ORDER BY id",
+    )
+
+
+async def get_user_destination_ids(user_id):
+    return [
+        row["destination_id"] for row in await get_user_destinations(user_id)
+    ]
+
+
+async def get_user_tracks(user_id):
+    return await _load_user(
+        "tracks",
+        user_id,
+        "SELECT * FROM tracks WHERE user_id = ? ORDER BY id",
+    )
+
+
+async def add_user_destination(user_id, destination_id, place):
+    """Add a destination along with its display place."""
+
+    rows = await _write(
+        "INSERT INTO destinations (user_id, destination_id, name, "
+        "latitude, longitude, metadata_updated) "
+        "VALUES (?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (user_id, destination_id) DO NOTHING "
+        "RETURNING *",
+        user_id,
+        destination_id,
+        place["name"],
+        place["latitude"],
+        place["longitude"],
+        time.time(),
+    )
+
+    cached_rows = user_cache.get(("destinations", user_id))
+    if cached_rows is not None:
+        cached_rows.extend(rows)
+
+
+async def remove_user_destination(user_id, destination_id):
+    await _write(
+        "DELETE FROM destinations WHERE user_id = ? AND destination_id = ?",
+        user_id,
+        destination_id,
+    )
+
+    rows = user_cache.get(("destinations", user_id))
+    if rows is not None:
+        rows[:] = [
+            row for row in rows if row["destination_id"] != destination_id
+        ]
+
+
+async def clear_user_destinations(user_id):
+    await _write("DELETE FROM destinations WHERE user_id = ?", user_id)
+
+    user_cache.set(("destinations", user_id), [], USER_CACHE_TTL)
+
+
+async def track_attraction(user_id, attraction_id, wait_threshold, place):
+    """Track an attraction, or update the threshold if already tracked."""
+
+    (track,) = await _write(
+        "INSERT INTO tracks (user_id, attraction_id, wait_threshold, name, "
+        "park_name, destination_name, latitude, longitude, "
+        "metadata_updated) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (user_id, attraction_id) DO UPDATE "
+        "SET wait_threshold = excluded.wait_threshold, reached_threshold = 0, "
+        "name = excluded.name, park_name = excluded.park_name, "
+        "destination_name = excluded.destination_name, "
+        "latitude = excluded.latitude, longitude = excluded.longitude, "
+        "metadata_updated = excluded.metadata_updated "
+        "RETURNING *",
+        user_id,
+        attraction_id,
+        wait_threshold,
+        place["name"],
+        place["park_name"],
+        place["destination_name"],
+        place["latitude"],
+        place["longitude"],
+        time.time(),
+    )
+
+    rows = user_cache.get(("tracks", user_id))
+    if rows is not None:
+        for i, row in enumerate(rows):
+            if row["id"] == track["id"]:
+                rows[i] = track
+                break
+        else:
+            rows.append(track)
+
+
+async def untrack_attraction(user_id, attraction_id):
+    await _write(
+        "DELETE FROM tracks WHERE user_id = ? AND attraction_id = ?",
+        user_id,
+        attraction_id,
+    )
+
+    rows = user_cache.get(("tracks", user_id))
+    if rows is not None:
+        rows[:] = [
+            row for row in rows if row["attraction_id"] != attraction_id
+        ]
+
+
+async def clear_user_tracks(user_id):
+    await _write("DELETE FROM tracks WHERE user_id = ?", user_id)
+
+    user_cache.set(("tracks", user_id), [], USER_CACHE_TTL)
+
+
+async def set_reached_thresholds(changes, channel_changes=()):
+    """Save reached_threshold changes to tracks and channel tracks at once.
+
+    changes are (reached_threshold, user_id, attraction_id) and
+    channel_changes are (reached_threshold, channel_id, attraction_id).
+    """
+
+    global _writes
+
+    _writes += 1
+    await execute_batch(
+        [
+            (
+                "UPDATE tracks "
+                "SET reached_threshold = ? "
+                "WHERE user_id = ? AND attraction_id = ?",
+                changes,
+            ),
+            (
+                "UPDATE channel_tracks "
+                "SET reached_threshold = ? "
+                "WHERE channel_id = ? AND attraction_id = ?",
+                channel_changes,
+            ),
+        ]
+    )
+
+    for reached_threshold, user_id, attraction_id in changes:
+        for row in user_cache.get(("tracks", user_id)) or ():
+            if row["attraction_id"] == attraction_id:
+                row["reached_threshold"] = reached_threshold
+
+
+async def get_channel_tracks(channel_id):
+    return await execute(
+        "SELECT * FROM channel_tracks WHERE channel_id = ? ORDER BY id",
+        channel_id,
+    )
+
+
+async def track_attraction_in_channel(
+    guild_id, channel_id, attraction_id, wait_threshold, place
+):
+    """Track an attraction for a channel, or update its threshold."""
+
+    await execute(
+        "INSERT INTO channel_tracks (guild_id, channel_id, attraction_id, "
+        "wait_threshold, name, park_name, destination_name, latitude, "
+        "longitude, metadata_updated) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+        "ON CONFLICT (channel_id, attraction_id) DO UPDATE "
+        "SET wait_threshold = excluded.wait_threshold, reached_threshold = 0",
+        guild_id,
+        channel_id,
+        attraction_id,
+        wait_threshold,
+        place["name"],
+        place["park_name"],
+        place["destination_name"],
+        place["latitude"],
+        place["longitude"],
+        time.time(),
+    )
+
+
+async def untrack_attraction_in_channel(channel_id, attraction_id):
+    await execute(
+        "DELETE FROM channel_tracks "
+        "WHERE channel_id = ? AND attraction_id = ?",
+        channel_id,
+        attraction_id,
+    )
+
+
+async def get_stale_place_ids(table, max_age):
+    """Get the entity IDs whose stored place is missing or too old."""
+
+    id_column, _ = PLACE_COLUMNS[table]
+
+    rows = await execute(
+        f"SELECT DISTINCT {id_column} FROM {table} "
+        "WHERE metadata_updated IS NULL OR metadata_updated < ?",
+        time.time() - max_age,
+    )
+
+    return [row[id_column] for row in rows]
+
+
+async def set_places(table, places):
+    """Store freshly resolved places, given as a dict keyed by entity ID."""
+
+    global _writes
+
+    id_column, columns = PLACE_COLUMNS[table]
+    updated = time.time()
+
+    _writes += 1
+    await execute_many(
+        f"UPDATE {table} SET "
+        + "".join(f"{column} = ?, " for column in columns)
+        + f"metadata_updated = ? WHERE {id_column} = ?",
+        (
+            (*(place[column] for column in columns), updated, entity_id)
+            for entity_id, place in places.items()
+        ),
+    )
+
+    for (cached_table, _), rows in user_cache.items():
+        if cached_table != table:
+            continue
+
+        for row in rows:
+            place = places.get(row[id_column])
+            if place is not None:
+                row.update({column: place[column] for column in columns})
+                row["metadata_updated"] = updated
+
+
+async def _load_user(table, user_id, sql):
+    """Get a copy of the user's cached rows, loading them on a miss."""
+
+    key = (table, user_id)
+    rows = user_cache.get(key)
+
+    if rows is None:
+        writes = _writes
+        rows = await execute(sql, user_id)
+
+        if writes == _writes:
+            user_cache.set(key, rows, USER_CACHE_TTL)
+
+    return list(rows)
+
+
+async def _write(sql, *args):
+    global _writes
+
+    _writes += 1
+    return await execute(sql, *args)
+
+
+def _connect():
+    connection = sqlite3.connect(
+        DATABASE_PATH,
+        isolation_level=None,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    connection.row_factory = sqlite3.Row
+
+    # WAL lets reads proceed while a write is in progress
+    connection.execute("PRAGMA journal_mode = WAL")
+    connection.execute("PRAGMA synchronous = NORMAL")
+    connection.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT}")
+
+    migrations.migrate(connection)
+
+    return connection
+
+
+def _get_connection():
+    global _connection
+
+    if _connection is None:
+        _connection = _connect()
+
+    return _connection
+
+
+def _execute(sql, args):
+    cursor = _get_connection().execute(sql, args)
+
+    if cursor.description is not None:
+        return [dict(row) for row in cursor.fetchall()]
+
+    if sql.lstrip().upper().startswith("INSERT"):
+        return cursor.lastrowid
+
+    return cursor.rowcount
+
+
+def _execute_many(statements):
+    connection = _get_connection()
+    rowcount = 0
+
+    connection.execute("BEGIN")
+
+    try:
+        for sql, params in statements:
+            if params:
+                rowcount += connection.executemany(sql, params).rowcount
+    except BaseException:
+        connection.execute("ROLLBACK")
+        raise
+
+    connection.execute("COMMIT")
+
+    return rowcount
+
+
+def _close():
+    global _connection
+
+    if _connection is not None:
+        _connection.close()
+        _connection = None
@@ -1,15 +1,16 @@
 import helpers.database as db
 import helpers.embed as embed
+import helpers.themeparks as themeparks
 
 
 def require_destinations(func):
     async def inner(interaction, *args, **kwargs):
         await interaction.response.defer()
-        rows = db.execute(
-            "SELECT * FROM destinations WHERE user_id = ?", interaction.user.id
+        destination_ids = await db.get_user_destination_ids(
+            interaction.user.id
         )
 
-        if not rows:
+        if not destination_ids:
             embed_message = embed.create_embed(
                 "Error",
                 "You have no destinations to search.\n"
@@ -23,3 +24,11 @@ def require_destinations(func):
         await func(interaction, *args, **kwargs)
 
     return inner
+
+
+def within_deadline(func):
+    async def inner(interaction, *args, **kwargs):
+        with themeparks.deadline(themeparks.COMMAND_DEADLINE):
+            await func(interaction, *args, **kwargs)
+
+    return inner
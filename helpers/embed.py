@@ -1,4 +1,5 @@
 import asyncio
+import logging
 
 import discord
 
@@ -7,57 +8,77 @@ import helpers.themeparks as themeparks
 EMBED_DEFAULTS = {"color": discord.Color(0x00A8FC)}
 
 MAX_FIELDS = 25
+MAX_EMBEDS = 10
 
 
-async def add_addresses(embed, entities, session, wait_thresholds=None):
-    if wait_thresholds is None:
-        wait_thresholds = tuple(None for _ in entities)
-
-    park_tasks = []
-    destination_tasks = []
-    for entity in entities:
-        park_tasks.append(asyncio.create_task(get_park(session, entity)))
-        destination_tasks.append(
-            asyncio.create_task(get_destination(session, entity))
-        )
+async def add_addresses(embed, entities, wait_thresholds=None):
+    parks, destinations = await get_parents(entities)
+
+    places = [
+        create_place(entity, park, destination)
+        for entity, park, destination in zip(entities, parks, destinations)
+    ]
+
+    add_places(embed, places, wait_thresholds)
 
-    parks = await asyncio.gather(*park_tasks)
-    destinations = await asyncio.gather(*destination_tasks)
 
-    for entity, park, destination, threshold in zip(
-        entities, parks, destinations, wait_thresholds
-    ):
+def add_places(embed, places, wait_thresholds=None):
+    """Add a field per place, such as a stored track or destination row."""
+
+    if wait_thresholds is None:
+        wait_thresholds = tuple(None for _ in places)
+
+    for place, threshold in zip(places, wait_thresholds):
         threshold_string = (
             f"Threshold: `{threshold}` minutes"
             if threshold is not None
             else ""
         )
 
-        if "location" in entity:
-            place = ""
+        embed.add_field(
+            name=f"{place['name']}\n{threshold_string}",
+            value=create_address(place),
+            inline=False,
+        )
 
-            if park is not None:
-                place += f"{park['name']} - "
-            if destination is not None:
-                place += f"{destination['name']}"
 
-            if not place:
-                place = "Google Maps"
+def create_address(place):
+    """Get a Google Maps link for a place, or "" without coordinates."""
 
-            location = entity["location"]
-            address = (
-                f"[{place}]"
-                "(https://www.google.com/maps/place/"
-                f"{location['latitude']},{location['longitude']})"
-            )
-        else:
-            address = ""
+    if place["latitude"] is None or place["longitude"] is None:
+        return ""
 
-        embed.add_field(
-            name=f"{entity['name']}\n{threshold_string}",
-            value=address,
-            inline=False,
-        )
+    location = ""
+
+    if place.get("park_name") is not None:
+        location += f"{place['park_name']} - "
+    if place.get("destination_name") is not None:
+        location += f"{place['destination_name']}"
+
+    if not location:
+        location = "Google Maps"
+
+    return (
+        f"[{location}]"
+        "(https://www.google.com/maps/place/"
+        f"{place['latitude']},{place['longitude']})"
+    )
+
+
+def create_place(entity, park=None, destination=None):
+    """Get the names and coordinates shown for an entity."""
+
+    location = entity.get("location") or {}
+
+    return {
+        "name": entity["name"],
+        "park_name": park["name"] if park is not None else None,
+        "destination_name": (
+            destination["name"] if destination is not None else None
+        ),
+        "latitude": location.get("latitude"),
+        "longitude": location.get("longitude"),
+    }
 
 
 def create_embed(title, description, color=EMBED_DEFAULTS["color"]):
@@ -81,11 +102,44 @@ def add_icon(embed, image_link):
     return embed
 
 
-async def get_park(session, entity):
-    if "parkId" in entity:
-        return await themeparks.get_entity(session, entity["parkId"])
+async def get_parents(entities, allow_stale=True):
+    """Get the park and destination of each entity.
+
+    Each distinct park and destination is fetched once for the whole
+    batch. Returns lists of parks and destinations in the same order as
+    the entities, with None where an entity has no park or destination or
+    it couldn't be fetched.
+    """
+
+    parent_ids = list(
+        {
+            entity[key]
+            for entity in entities
+            for key in ("parkId", "destinationId")
+            if entity.get(key) is not None
+        }
+    )
+
+    results = await asyncio.gather(
+        *(
+            themeparks.get_entity(id, allow_stale=allow_stale)
+            for id in parent_ids
+        ),
+        return_exceptions=True,
+    )
+
+    parents = {}
+    for parent_id, result in zip(parent_ids, results):
+        if isinstance(result, themeparks.ThemeParksError):
+            logging.warning("Failed to get %s: %s", parent_id, result)
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            parents[parent_id] = result
 
+    parks = [parents.get(entity.get("parkId")) for entity in entities]
+    destinations = [
+        parents.get(entity.get("destinationId")) for entity in entities
+    ]
 
-async def get_destination(session, entity):
-    if "destinationId" in entity:
-        return await themeparks.get_entity(session, entity["destinationId"])
+    return parks, destinations
@@ -0,0 +1,103 @@
+# Schema migrations for themeparkify.db. Migration N (counting from 1) is
+# applied when PRAGMA user_version is below N, so existing migrations must
+# never be edited; add a new one instead.
+MIGRATIONS = [
+    # 1: base tables
+    (
+        "CREATE TABLE IF NOT EXISTS destinations("
+        "id INTEGER NOT NULL UNIQUE, "
+        "user_id INTEGER NOT NULL, "
+        "destination_id TEXT NOT NULL, "
+        "PRIMARY KEY(id))",
+        "CREATE TABLE IF NOT EXISTS tracks("
+        "id INTEGER NOT NULL UNIQUE, "
+        "user_id INTEGER NOT NULL, "
+        "attraction_id TEXT NOT NULL, "
+        "wait_threshold INTEGER NOT NULL, "
+        "reached_threshold INTEGER NOT NULL DEFAULT 0, "
+        "PRIMARY KEY(id))",
+    ),
+    # 2: one row per user and attraction or destination, indexed for the
+    # per-user lookups and the tracker's per-attraction updates
+    (
+        "DELETE FROM tracks WHERE id NOT IN "
+        "(SELECT MAX(id) FROM tracks GROUP BY user_id, attraction_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS tracks_user_attraction "
+        "ON tracks (user_id, attraction_id)",
+        "CREATE INDEX IF NOT EXISTS tracks_attraction "
+        "ON tracks (attraction_id)",
+        "DELETE FROM destinations WHERE id NOT IN "
+        "(SELECT MIN(id) FROM destinations GROUP BY user_id, destination_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS destinations_user_destination "
+        "ON destinations (user_id, destination_id)",
+    ),
+    # 3: display names and coordinates stored with each row so listings
+    # don't need the API; metadata_updated is when they were last resolved
+    (
+        "ALTER TABLE tracks ADD COLUMN name TEXT",
+        "ALTER TABLE tracks ADD COLUMN park_name TEXT",
+        "ALTER TABLE tracks ADD COLUMN destination_name TEXT",
+        "ALTER TABLE tracks ADD COLUMN latitude REAL",
+        "ALTER TABLE tracks ADD COLUMN longitude REAL",
+        "ALTER TABLE tracks ADD COLUMN metadata_updated REAL",
+        "ALTER TABLE destinations ADD COLUMN name TEXT",
+        "ALTER TABLE destinations ADD COLUMN latitude REAL",
+        "ALTER TABLE destinations ADD COLUMN longitude REAL",
+        "ALTER TABLE destinations ADD COLUMN metadata_updated REAL",
+    ),
+    # 4: attractions tracked for a whole guild channel, posted to the
+    # channel instead of each member's DMs
+    (
+        "CREATE TABLE IF NOT EXISTS channel_tracks("
+        "id INTEGER NOT NULL UNIQUE, "
+        "guild_id INTEGER NOT NULL, "
+        "channel_id INTEGER NOT NULL, "
+        "attraction_id TEXT NOT NULL, "
+        "wait_threshold INTEGER NOT NULL, "
+        "reached_threshold INTEGER NOT NULL DEFAULT 0, "
+        "name TEXT, "
+        "park_name TEXT, "
+        "destination_name TEXT, "
+        "latitude REAL, "
+        "longitude REAL, "
+        "metadata_updated REAL, "
+        "PRIMARY KEY(id))",
+        "CREATE UNIQUE INDEX IF NOT EXISTS channel_tracks_channel_attraction "
+        "ON channel_tracks (channel_id, attraction_id)",
+        "CREATE INDEX IF NOT EXISTS channel_tracks_attraction "
+        "ON channel_tracks (attraction_id)",
+    ),
+]
+
+
+def get_version(connection):
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(connection):
+    """Apply any pending migrations, each in its own transaction.
+
+    Returns the resulting schema version.
+    """
+
+    version = get_version(connection)
+
+    for number, statements in enumerate(MIGRATIONS, start=1):
+        if number <= version:
+            continue
+
+        connection.execute("BEGIN IMMEDIATE")
+
+        try:
+            for statement in statements:
+                connection.execute(statement)
+
+            connection.execute(f"PRAGMA user_version = {number}")
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+
+        connection.execute("COMMIT")
+        version = number
+
+    return version
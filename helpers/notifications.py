@@ -0,0 +1,211 @@
+import asyncio
+import collections
+import logging
+import os
+import random
+import time
+
+import discord
+
+import helpers.embed as embed
+from helpers.cache import TTLCache
+
+# Alerts are sent by background workers so the tracker never waits on
+# Discord. Alerts for the same user or channel always go through the same
+# worker, keeping them in order and one channel's rate limit from
+# spreading to others.
+NOTIFICATION_WORKERS = int(os.getenv("NOTIFICATION_WORKERS", 4))
+NOTIFICATION_QUEUE_SIZE = int(os.getenv("NOTIFICATION_QUEUE_SIZE", 1000))
+# Seconds to keep sending queued alerts when shutting down
+NOTIFICATION_DRAIN_TIMEOUT = 5
+
+MAX_SEND_RETRIES = 3
+SEND_BACKOFF_BASE = 1
+SEND_BACKOFF_MAX = 60
+
+USER_CACHE_MAX_ENTRIES = 10_000
+USER_CACHE_TTL = 60 * 60
+CHANNEL_CACHE_MAX_ENTRIES = 1000
+CHANNEL_CACHE_TTL = 60 * 60
+
+# Most recent messages of alerts that couldn't be delivered
+DEAD_LETTER_MAX = 1000
+
+_client = None
+_queues = []
+_workers = []
+
+user_cache = TTLCache(USER_CACHE_MAX_ENTRIES)
+channel_cache = TTLCache(CHANNEL_CACHE_MAX_ENTRIES)
+dead_letters = collections.deque(maxlen=DEAD_LETTER_MAX)
+send_stats = {"sent": 0, "messages": 0, "retries": 0, "failed": 0}
+
+
+def start(client):
+    """Start the sender workers for the given client."""
+
+    global _client
+
+    _client = client
+
+    for _ in range(NOTIFICATION_WORKERS):
+        queue = asyncio.Queue(
+            maxsize=max(1, NOTIFICATION_QUEUE_SIZE // NOTIFICATION_WORKERS)
+        )
+        _queues.append(queue)
+        _workers.append(asyncio.create_task(_work(queue)))
+
+
+async def stop():
+    """Stop the sender workers once queued alerts are sent or time runs out.
+
+    The tracker saves alerts as sent once they're queued, so any still
+    unsent are recorded in dead_letters rather than dropped.
+    """
+
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(*(queue.join() for queue in _queues)),
+            NOTIFICATION_DRAIN_TIMEOUT,
+        )
+    except asyncio.TimeoutError:
+        pass
+
+    for worker in _workers:
+        worker.cancel()
+
+    await asyncio.gather(*_workers, return_exceptions=True)
+
+    for queue in _queues:
+        while not queue.empty():
+            _dead_letter(*queue.get_nowait(), _shutdown_error())
+
+    _workers.clear()
+    _queues.clear()
+
+
+async def queue_alerts(user_id, alert_embeds):
+    """Queue alerts to be sent to a user in as few messages as possible.
+
+    Each message holds up to embed.MAX_EMBEDS alerts. Waits only if the
+    user's queue is full.
+    """
+
+    await _queue_messages("user", user_id, alert_embeds)
+
+
+async def queue_channel_alerts(channel_id, alert_embeds):
+    """Queue alerts to be posted to a channel, like queue_alerts."""
+
+    await _queue_messages("channel", channel_id, alert_embeds)
+
+
+def pending():
+    return sum(queue.qsize() for queue in _queues)
+
+
+async def get_user(user_id):
+    """Get a user, fetching them from Discord if they aren't cached."""
+
+    user = _client.get_user(user_id) or user_cache.get(user_id)
+
+    if user is None:
+        user = await _client.fetch_user(user_id)
+        user_cache.set(user_id, user, USER_CACHE_TTL)
+
+    return user
+
+
+async def get_channel(channel_id):
+    """Get a channel, fetching it from Discord if it isn't cached."""
+
+    channel = _client.get_channel(channel_id) or channel_cache.get(channel_id)
+
+    if channel is None:
+        channel = await _client.fetch_channel(channel_id)
+        channel_cache.set(channel_id, channel, CHANNEL_CACHE_TTL)
+
+    return channel
+
+
+async def _queue_messages(kind, target_id, alert_embeds):
+    queue = _queues[target_id % len(_queues)]
+
+    for i in range(0, len(alert_embeds), embed.MAX_EMBEDS):
+        await queue.put(
+            (kind, target_id, alert_embeds[i : i + embed.MAX_EMBEDS])
+        )
+
+
+async def _work(queue):
+    while True:
+        kind, target_id, alert_embeds = await queue.get()
+
+        try:
+            await _send(kind, target_id, alert_embeds)
+        except asyncio.CancelledError:
+            _dead_letter(kind, target_id, alert_embeds, _shutdown_error())
+            raise
+        except Exception:
+            logging.exception("Failed to send an alert to %s", target_id)
+        finally:
+            queue.task_done()
+
+
+async def _send(kind, target_id, alert_embeds):
+    """Send a message of alerts, retrying Discord server errors with backoff.
+
+    discord.py already waits out rate limits itself. Alerts that can't be
+    delivered are recorded in dead_letters.
+    """
+
+    for attempt in range(MAX_SEND_RETRIES + 1):
+        try:
+            if kind == "user":
+                user = await get_user(target_id)
+                await user.send(content=f"<@{target_id}>", embeds=alert_embeds)
+            else:
+                channel = await get_channel(target_id)
+                await channel.send(embeds=alert_embeds)
+        except (discord.Forbidden, discord.NotFound) as error:
+            # The target is gone or can't be messaged, so retrying won't help
+            return _dead_letter(kind, target_id, alert_embeds, error)
+        except (discord.HTTPException, OSError, asyncio.TimeoutError) as error:
+            if attempt == MAX_SEND_RETRIES:
+                return _dead_letter(kind, target_id, alert_embeds, error)
+
+            delay = random.uniform(
+                0, min(SEND_BACKOFF_MAX, SEND_BACKOFF_BASE * 2**attempt)
+            )
+            logging.warning(
+                "Sending an alert to %s failed: %s, retrying in %.1f seconds",
+                target_id,
+                error,
+                delay,
+            )
+
+            send_stats["retries"] += 1
+            await asyncio.sleep(delay)
+        else:
+            send_stats["sent"] += len(alert_embeds)
+            send_stats["messages"] += 1
+            return
+
+
+def _shutdown_error():
+    return asyncio.CancelledError("the bot shut down before it was sent")
+
+
+def _dead_letter(kind, target_id, alert_embeds, error):
+    logging.warning("Couldn't send an alert to %s: %s", target_id, error)
+
+    send_stats["failed"] += len(alert_embeds)
+    dead_letters.append(
+        {
+            "kind": kind,
+            "target_id": target_id,
+            "titles": [alert_embed.title for alert_embed in alert_embeds],
+            "error": f"{type(error).__name__}: {error}",
+            "time": time.time(),
+        }
+    )
@@ -0,0 +1,97 @@
+import asyncio
+import logging
+
+import helpers.database as db
+import helpers.embed as embed
+import helpers.themeparks as themeparks
+
+# Tracks and destinations store the names and coordinates they're listed
+# with, so listing them never calls the API. A background job re-resolves
+# stored places once they're older than PLACE_MAX_AGE.
+PLACE_MAX_AGE = 24 * 60 * 60
+PLACE_REFRESH_INTERVAL = 60 * 60
+
+
+async def get_place(entity_id, allow_stale=True):
+    """Resolve an entity's display place from the API."""
+
+    entity = await themeparks.get_entity(entity_id, allow_stale=allow_stale)
+    if "name" not in entity:
+        raise themeparks.ThemeParksError(f"{entity_id} was not found")
+
+    (park,), (destination,) = await embed.get_parents([entity], allow_stale)
+
+    # A parent that couldn't be fetched would be stored as missing
+    if (park is None and entity.get("parkId") is not None) or (
+        destination is None and entity.get("destinationId") is not None
+    ):
+        raise themeparks.ThemeParksError(
+            f"{entity_id}'s park or destination couldn't be fetched"
+        )
+
+    return embed.create_place(entity, park, destination)
+
+
+async def fill_missing(table, rows):
+    """Resolve and store places for rows saved before they were kept."""
+
+    id_column, _ = db.PLACE_COLUMNS[table]
+
+    missing_ids = {row[id_column] for row in rows if row["name"] is None}
+    if not missing_ids:
+        return
+
+    places = await resolve(missing_ids)
+    await db.set_places(table, places)
+
+    for row in rows:
+        if row[id_column] in places:
+            row.update(places[row[id_column]])
+
+
+async def resolve(entity_ids, allow_stale=True):
+    """Resolve places for many entities, skipping ones that fail."""
+
+    entity_ids = list(entity_ids)
+
+    results = await asyncio.gather(
+        *(get_place(entity_id, allow_stale) for entity_id in entity_ids),
+        return_exceptions=True,
+    )
+
+    places = {}
+    for entity_id, result in zip(entity_ids, results):
+        if isinstance(result, themeparks.ThemeParksError):
+            logging.warning("Failed to resolve %s: %s", entity_id, result)
+        elif isinstance(result, BaseException):
+            raise result
+        else:
+            places[entity_id] = result
+
+    return places
+
+
+async def refresh():
+    """Re-resolve every stored place that is missing or out of date."""
+
+    for table in db.PLACE_COLUMNS:
+        entity_ids = await db.get_stale_place_ids(table, PLACE_MAX_AGE)
+
+        # Fresh data only, so places the API can't serve stay stale and
+        # are retried on the next refresh
+        if entity_ids:
+            await db.set_places(
+                table, await resolve(entity_ids, allow_stale=False)
+            )
+
+
+async def maintain():
+    """Keep stored places fresh in the background."""
+
+    while True:
+        try:
+            await refresh()
+        except Exception:
+            logging.exception("Failed to refresh stored places")
+
+        await asyncio.sleep(PLACE_REFRESH_INTERVAL)
@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+
+class RateLimiter:
+    """Token bucket limiting both request rate and requests in flight.
+
+    Use as `async with limiter:` around each request. Time spent waiting
+    for a slot is recorded so queueing can be monitored.
+    """
+
+    def __init__(self, rate, burst, max_in_flight):
+        self.rate = rate
+        self.burst = burst
+
+        self.requests = 0
+        self.queued_time = 0.0
+        self.max_queued_time = 0.0
+
+        self._tokens = burst
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        start = time.monotonic()
+
+        await self._semaphore.acquire()
+
+        try:
+            async with self._lock:
+                await self._take_token()
+        except BaseException:
+            self._semaphore.release()
+            raise
+
+        queued = time.monotonic() - start
+
+        self.requests += 1
+        self.queued_time += queued
+        self.max_queued_time = max(self.max_queued_time, queued)
+
+    async def __aexit__(self, *exc_info):
+        self._semaphore.release()
+
+    def block_for(self, seconds):
+        """Hold back every request for the given number of seconds."""
+
+        self._blocked_until = max(
+            self._blocked_until, time.monotonic() + seconds
+        )
+
+    def stats(self):
+        return {
+            "requests": self.requests,
+            "queued_time": self.queued_time,
+            "average_queued_time": (
+                self.queued_time / self.requests if self.requests else 0.0
+            ),
+            "max_queued_time": self.max_queued_time,
+        }
+
+    async def _take_token(self):
+        while True:
+            now = time.monotonic()
+
+            if now < self._blocked_until:
+                await asyncio.sleep(self._blocked_until - now)
+                continue
+
+            self._tokens = min(
+                self.burst, self._tokens + (now - self._updated) * self.rate
+            )
+            self._updated = now
+
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self._tokens) / self.rate)
@@ -0,0 +1,116 @@
+import heapq
+import time
+from collections import deque
+
+# Bounds, in seconds, on how often a single attraction is polled
+MIN_INTERVAL = 5
+MAX_INTERVAL = 5 * 60
+# Interval for attractions that are down while their park is open
+DOWN_INTERVAL = 30
+# Extra seconds between polls per minute the wait is from a threshold
+DISTANCE_FACTOR = 6
+# Change in wait, in minutes per poll, that halves the interval
+VOLATILITY_SCALE = 5
+HISTORY_LENGTH = 12
+
+
+class PollScheduler:
+    """Priority queue deciding when each tracked attraction is next polled.
+
+    Attractions whose wait is close to a threshold or has been moving a
+    lot are polled often, while quiet attractions far from any threshold
+    back off towards MAX_INTERVAL.
+    """
+
+    def __init__(self):
+        self._heap = []
+        self._due = {}
+        self._history = {}
+
+    def sync(self, attraction_ids, now=None):
+        """Start polling new attractions and forget untracked ones."""
+
+        if now is None:
+            now = time.time()
+
+        attraction_ids = set(attraction_ids)
+
+        for attraction_id in attraction_ids - self._due.keys():
+            self.schedule_at(attraction_id, now)
+
+        for attraction_id in self._due.keys() - attraction_ids:
+            del self._due[attraction_id]
+            self._history.pop(attraction_id, None)
+
+    def schedule_at(self, attraction_id, when):
+        self._due[attraction_id] = when
+        heapq.heappush(self._heap, (when, attraction_id))
+
+    def pop_due(self, now=None):
+        """Get every attraction whose next poll time has passed."""
+
+        if now is None:
+            now = time.time()
+
+        due = []
+
+        while self._heap and self._heap[0][0] <= now:
+            when, attraction_id = heapq.heappop(self._heap)
+
+            # Skip entries superseded by a later schedule_at or sync
+            if self._due.get(attraction_id) != when:
+                continue
+
+            # Until record_poll or schedule_at runs again, the next sync
+            # treats the attraction as new, so a failed poll is retried
+            del self._due[attraction_id]
+            due.append(attraction_id)
+
+        return due
+
+    def next_due(self):
+        """Get the time of the next poll, or None if nothing is tracked."""
+
+        while self._heap:
+            when, attraction_id = self._heap[0]
+
+            if self._due.get(attraction_id) == when:
+                return when
+
+            heapq.heappop(self._heap)
+
+        return None
+
+    def record_poll(self, attraction_id, status, wait, thresholds, now=None):
+        """Schedule the next poll of an attraction from its latest state."""
+
+        if now is None:
+            now = time.time()
+
+        if status != "OPERATING" or wait is None:
+            self.schedule_at(attraction_id, now + DOWN_INTERVAL)
+            return
+
+        history = self._history.setdefault(
+            attraction_id, deque(maxlen=HISTORY_LENGTH)
+        )
+        history.append(wait)
+
+        distance = min(abs(wait - threshold) for threshold in thresholds)
+        interval = MIN_INTERVAL + distance * DISTANCE_FACTOR
+        interval /= 1 + get_volatility(history) / VOLATILITY_SCALE
+
+        interval = max(MIN_INTERVAL, min(MAX_INTERVAL, interval))
+        self.schedule_at(attraction_id, now + interval)
+
+
+def get_volatility(history):
+    """Get the mean absolute change between consecutive waits."""
+
+    if len(history) < 2:
+        return 0
+
+    waits = list(history)
+    changes = [abs(b - a) for a, b in zip(waits, waits[1:])]
+
+    return sum(changes) / len(changes)
@@ -0,0 +1,263 @@
+import heapq
+from collections import Counter
+
+import helpers.catalog as catalog
+
+NGRAM_SIZE = 3
+# Share of a query's trigrams a name needs to count as a fuzzy match
+FUZZY_THRESHOLD = 0.5
+
+_destination_indexes = {}
+_destinations_index = None
+
+
+def normalize(name):
+    return name.strip().lower()
+
+
+def ngrams(text):
+    return {
+        text[i : i + NGRAM_SIZE] for i in range(len(text) - NGRAM_SIZE + 1)
+    }
+
+
+class NameIndex:
+    """Trigram inverted index for substring searches over names."""
+
+    def __init__(self, names):
+        self.names = [normalize(name) for name in names]
+        self.postings = {}
+
+        for i, name in enumerate(self.names):
+            for gram in ngrams(name):
+                self.postings.setdefault(gram, []).append(i)
+
+    def search(self, query):
+        """Get the positions of all names containing the query, in order."""
+
+        query = normalize(query)
+
+        if len(query) < NGRAM_SIZE:
+            candidates = range(len(self.names))
+        else:
+            postings = []
+            for gram in ngrams(query):
+                if gram not in self.postings:
+                    return []
+
+                postings.append(self.postings[gram])
+
+            postings.sort(key=len)
+
+            candidates = set(postings[0])
+            for posting in postings[1:]:
+                candidates.intersection_update(posting)
+
+            candidates = sorted(candidates)
+
+        return [i for i in candidates if query in self.names[i]]
+
+    def suggest(self, query, limit, accept=None):
+        """Rank names for autocompletion.
+
+        Exact matches come first, then prefixes, word prefixes, substrings
+        and finally names sharing enough trigrams with the query. Returns
+        up to `limit` `(rank, position)` pairs, best first.
+        """
+
+        query = normalize(query)
+        grams = ngrams(query)
+
+        if grams:
+            shared = Counter()
+            for gram in grams:
+                shared.update(self.postings.get(gram, ()))
+
+            candidates = (
+                (i, count / len(grams))
+                for i, count in shared.items()
+                if count / len(grams) >= FUZZY_THRESHOLD
+            )
+        else:
+            candidates = ((i, 0.0) for i in range(len(self.names)))
+
+        ranked = []
+
+        for i, similarity in candidates:
+            if accept is not None and not accept(i):
+                continue
+
+            name = self.names[i]
+
+            if name == query:
+                tier = 0
+            elif name.startswith(query):
+                tier = 1
+            elif f" {query}" in name:
+                tier = 2
+            elif query in name:
+                tier = 3
+            elif grams:
+                tier = 4
+            else:
+                continue
+
+            ranked.append(((tier, -similarity, len(name), name), i))
+
+        return heapq.nsmallest(limit, ranked)
+
+
+class DestinationIndex:
+    """Searchable index over one destination's parks and their children."""
+
+    def __init__(self, destination):
+        self.parks = destination["parks"]
+        self.park_index = NameIndex(park["name"] for park in self.parks)
+
+        self.children = []
+        self.child_park_ids = []
+        for park in self.parks:
+            for child in catalog.get_children(park["id"]) or ():
+                self.children.append(child)
+                self.child_park_ids.append(park["id"])
+
+        self.child_index = NameIndex(child["name"] for child in self.children)
+
+    def get_park(self, park_id):
+        for park in self.parks:
+            if park["id"] == park_id:
+                return park
+
+    def search_parks(self, query):
+        return [self.parks[i] for i in self.park_index.search(query)]
+
+    def search_children(self, query, park_ids, entity_type=None):
+        matches = []
+
+        for i in self.child_index.search(query):
+            child = self.children[i]
+
+            if self.child_park_ids[i] not in park_ids:
+                continue
+
+            if entity_type is not None and entity_type != child["entityType"]:
+                continue
+
+            matches.append(child)
+
+        return matches
+
+
+def get_destination_index(destination):
+    """Get a destination's index, rebuilding it if the catalog changed."""
+
+    stamp = tuple(
+        (park["id"], catalog.get_children_updated(park["id"]))
+        for park in destination["parks"]
+    )
+
+    cached = _destination_indexes.get(destination["id"])
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    index = DestinationIndex(destination)
+    _destination_indexes[destination["id"]] = (stamp, index)
+
+    return index
+
+
+def search_destinations(destinations, query):
+    """Get the destinations whose names contain the query, in order."""
+
+    index = _get_destinations_index(destinations)
+    return [destinations[i] for i in index.search(query)]
+
+
+def suggest_destinations(destinations, query, limit, destination_ids=None):
+    """Get the destinations best matching a partial name."""
+
+    index = _get_destinations_index(destinations)
+
+    if destination_ids is not None:
+
+        def accept(i):
+            return destinations[i]["id"] in destination_ids
+
+    else:
+        accept = None
+
+    return [destinations[i] for _, i in index.suggest(query, limit, accept)]
+
+
+def _get_destinations_index(destinations):
+    global _destinations_index
+
+    if _destinations_index is None or _destinations_index[0] is not (
+        destinations
+    ):
+        _destinations_index = (
+            destinations,
+            NameIndex(destination["name"] for destination in destinations),
+        )
+
+    return _destinations_index[1]
+
+
+def suggest_parks(destinations, query, limit):
+    """Get the parks best matching a partial name.
+
+    Returns `(park, destination)` pairs.
+    """
+
+    ranked = []
+
+    for destination in destinations:
+        index = get_destination_index(destination)
+
+        for rank, i in index.park_index.suggest(query, limit):
+            ranked.append((rank, index.parks[i], destination))
+
+    return [
+        (park, destination)
+        for _, park, destination in heapq.nsmallest(
+            limit, ranked, key=lambda item: item[0]
+        )
+    ]
+
+
+def suggest_children(
+    destinations, query, limit, park_ids=None, entity_type=None
+):
+    """Get the park children best matching a partial name.
+
+    Only uses children already in the catalog. Returns `(child, park)`
+    pairs.
+    """
+
+    ranked = []
+
+    for destination in destinations:
+        index = get_destination_index(destination)
+
+        def accept(i):
+            if (
+                park_ids is not None
+                and index.child_park_ids[i] not in park_ids
+            ):
+                return False
+
+            return (
+                entity_type is None
+                or index.children[i]["entityType"] == entity_type
+            )
+
+        for rank, i in index.child_index.suggest(query, limit, accept):
+            park = index.get_park(index.child_park_ids[i])
+            ranked.append((rank, index.children[i], park))
+
+    return [
+        (child, park)
+        for _, child, park in heapq.nsmallest(
+            limit, ranked, key=lambda item: item[0]
+        )
+    ]
@@ -0,0 +1,45 @@
+import asyncio
+
+
+class SingleFlight:
+    """Shares one task between concurrent callers asking for the same key.
+
+    Callers asking for a key whose task is still running wait on that
+    task instead of starting their own. The task is forgotten once done,
+    so the next caller starts afresh.
+    """
+
+    def __init__(self):
+        self._tasks = {}
+
+    def __len__(self):
+        return len(self._tasks)
+
+    def start(self, key, start):
+        """Get the task running for key, calling start() for one if none is.
+
+        start must return a coroutine.
+        """
+
+        task = self._tasks.get(key)
+
+        if task is None:
+            task = asyncio.create_task(start())
+            self._tasks[key] = task
+            task.add_done_callback(lambda done: self._finish(key, done))
+
+        return task
+
+    async def run(self, key, start):
+        """Wait for the task for key, starting it if needed."""
+
+        # Shielded so one caller giving up doesn't cancel the shared task
+        return await asyncio.shield(self.start(key, start))
+
+    def _finish(self, key, task):
+        if self._tasks.get(key) is task:
+            del self._tasks[key]
+
+        # Mark the exception as retrieved in case every caller was cancelled
+        if not task.cancelled():
+            task.exception()
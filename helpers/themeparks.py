@@ -1,19 +1,244 @@
 import asyncio
+import contextlib
+import contextvars
+import datetime as dt
+import email.utils
+import hashlib
+import json
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass
+
+import aiohttp
+from dateutil import parser
+from dotenv import load_dotenv
+
+import helpers.catalog as catalog
+import helpers.search_index as search_index
+from helpers.cache import TTLCache
+from helpers.circuitbreaker import CircuitBreaker
+from helpers.ratelimit import RateLimiter
+from helpers.singleflight import SingleFlight
+
+load_dotenv()
 
 # ThemeParks API: https://api.themeparks.wiki/docs/v1/
 API_URL = "https://api.themeparks.wiki/v1"
 
+CONNECTION_LIMIT = 100
+CONNECTION_LIMIT_PER_HOST = 20
+KEEPALIVE_TIMEOUT = 60
+DNS_CACHE_TTL = 300
+REQUEST_TIMEOUT = 30
+
+# Outbound request budget shared by every caller
+REQUESTS_PER_SECOND = 5
+REQUEST_BURST = 10
+MAX_IN_FLIGHT = 10
+
+MAX_RETRIES = 4
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+
+# Requests in a row that ran out of retries before API calls are turned
+# away, and seconds before another is tried. Only failures that point at
+# the whole API count, not a single entity's server errors.
+BREAKER_FAILURE_THRESHOLD = 5
+BREAKER_RESET_TIMEOUT = 30
+BREAKER_STATUSES = {429, 503}
+
+# Seconds to wait for a response before serving an expired copy instead,
+# and before giving up when there is none. Either way the request carries
+# on in the background to refresh the cache.
+LATENCY_BUDGET = float(os.getenv("THEMEPARKS_LATENCY_BUDGET", 2))
+REQUEST_DEADLINE = float(os.getenv("THEMEPARKS_REQUEST_DEADLINE", 10))
+# Seconds a command may spend waiting on the API in total, however many
+# lookups it makes
+COMMAND_DEADLINE = float(os.getenv("THEMEPARKS_COMMAND_DEADLINE", 10))
+
+# Seconds each kind of entity response is cached for, keyed by type
+ENTITY_CACHE_TTLS = {
+    None: 24 * 60 * 60,
+    "children": 6 * 60 * 60,
+    "schedule": 24 * 60 * 60,
+    "live": 10,
+}
+DESTINATIONS_CACHE_TTL = 60 * 60
+ENTITY_CACHE_MAX_ENTRIES = int(os.getenv("ENTITY_CACHE_MAX_ENTRIES", 5000))
+ENTITY_CACHE_MAX_BYTES = int(
+    os.getenv("ENTITY_CACHE_MAX_BYTES", 64 * 1024 * 1024)
+)
+# Seconds expired responses are kept to serve while the API is struggling
+ENTITY_STALE_TTL = 24 * 60 * 60
+
+# Validators and bodies of responses that sent an ETag or Last-Modified,
+# keyed by URL, so refetching them is a conditional request and a 304
+# reuses the stored body
+VALIDATOR_CACHE_TTL = 24 * 60 * 60
+# Seconds a feed's parsed live records are kept to compare the next fetch
+# against
+LIVE_RECORDS_TTL = 60 * 60
+
+# How old catalog data may get before the background refresh replaces it
+CATALOG_MAX_AGE = 6 * 60 * 60
+CATALOG_REFRESH_INTERVAL = 15 * 60
+# Parks refreshed between catalog saves
+CATALOG_SAVE_BATCH = 25
+
+_session = None
+_in_flight = SingleFlight()
+_refreshes = SingleFlight()
+# Monotonic time the running command stops waiting on the API at, if it
+# has a deadline
+_deadline = contextvars.ContextVar("deadline", default=None)
+
+entity_cache = TTLCache(
+    ENTITY_CACHE_MAX_ENTRIES, ENTITY_CACHE_MAX_BYTES, ENTITY_STALE_TTL
+)
+validator_cache = TTLCache(ENTITY_CACHE_MAX_ENTRIES, ENTITY_CACHE_MAX_BYTES)
+# Each live feed's records keyed by ID, alongside the fingerprint of the
+# entry each was parsed from
+live_records = TTLCache(ENTITY_CACHE_MAX_ENTRIES)
+limiter = RateLimiter(REQUESTS_PER_SECOND, REQUEST_BURST, MAX_IN_FLIGHT)
+breaker = CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+
+
+class ThemeParksError(Exception):
+    """Raised when the ThemeParks API can't be reached or keeps failing."""
+
+
+# Live data is parsed once into these records, with times already turned
+# into datetimes, rather than walking the raw JSON wherever it's used.
+
+
+@dataclass(frozen=True, slots=True)
+class ReturnTime:
+    state: str
+    start: dt.datetime | None
+    # Price in the currency's minor unit, for paid return times
+    price: int | None
+    currency: str | None
+
+
+@dataclass(frozen=True, slots=True)
+class OperatingHours:
+    type: str
+    start: dt.datetime
+    end: dt.datetime
+
+
+@dataclass(frozen=True, slots=True)
+class ForecastPoint:
+    time: dt.datetime
+    wait: int
+
+
+@dataclass(frozen=True, slots=True)
+class LiveData:
+    id: str
+    name: str
+    status: str
+    has_queue: bool
+    # Standby wait in minutes
+    wait: int | None
+    return_time: ReturnTime | None
+    operating_hours: tuple[OperatingHours, ...]
+    forecast: tuple[ForecastPoint, ...]
+
+
+async def open_session():
+    """Create the shared HTTP session used for all API calls."""
+
+    global _session
 
-async def get_destinations(session):
-    """Get destinations via an API call."""
+    if _session is not None and not _session.closed:
+        return _session
 
-    async with session.get(f"{API_URL}/destinations") as response:
-        json = await response.json()
-        return json["destinations"]
+    connector = aiohttp.TCPConnector(
+        limit=CONNECTION_LIMIT,
+        limit_per_host=CONNECTION_LIMIT_PER_HOST,
+        keepalive_timeout=KEEPALIVE_TIMEOUT,
+        ttl_dns_cache=DNS_CACHE_TTL,
+        resolver=aiohttp.AsyncResolver(),
+    )
+    _session = aiohttp.ClientSession(
+        connector=connector,
+        timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+    )
 
+    return _session
 
-async def get_entity(session, entity_id, type=None, year=None, month=None):
-    """Get entity via an API call."""
+
+async def close_session():
+    """Close the shared HTTP session and its pooled connections."""
+
+    global _session
+
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+async def get_session():
+    """Get the shared HTTP session, creating it if needed."""
+
+    if _session is None or _session.closed:
+        return await open_session()
+
+    return _session
+
+
+@contextlib.contextmanager
+def deadline(seconds):
+    """Cap the total time API lookups within the block can wait for."""
+
+    token = _deadline.set(time.monotonic() + seconds)
+
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+async def get_destinations(allow_stale=True):
+    """Get destinations via an API call, reusing a cached response if fresh.
+
+    While the API is slow or down, an expired response may be returned
+    unless allow_stale is False.
+    """
+
+    key = ("destinations",)
+
+    data = entity_cache.get(key)
+
+    if data is None:
+        url = f"{API_URL}/destinations"
+        data, _ = await _get_within_budget(
+            key,
+            lambda: _get_json(url, key, DESTINATIONS_CACHE_TTL),
+            allow_stale,
+        )
+
+    return data["destinations"]
+
+
+async def get_entity(
+    entity_id, type=None, year=None, month=None, allow_stale=True
+):
+    """Get entity via an API call, reusing cached responses when fresh.
+
+    While the API is slow or down, an expired response may be returned
+    unless allow_stale is False.
+    """
+
+    key = (entity_id, type, year, month)
+
+    data = entity_cache.get(key)
+    if data is not None:
+        return data
 
     url = f"{API_URL}/entity/{entity_id}"
 
@@ -23,12 +248,428 @@ async def get_entity(session, entity_id, type=None, year=None, month=None):
         if type == "schedule" and None not in (year, month):
             url += f"/{year}/{month}"
 
-    async with session.get(url) as response:
-        return await response.json()
+    ttl = ENTITY_CACHE_TTLS.get(type, ENTITY_CACHE_TTLS["live"])
+
+    data, _ = await _get_within_budget(
+        key, lambda: _get_json(url, key, ttl), allow_stale
+    )
+
+    return data
+
+
+async def get_live_data(entity_id):
+    """Get live data for an entity and everything in it, keyed by ID.
+
+    A park's live data covers each of its attractions. The parsed
+    records are cached rather than the raw response. Entries that haven't
+    changed since the last fetch keep their previous record, so callers
+    can tell them apart by comparing records.
+    """
+
+    live_data, _ = await get_live_data_with_age(entity_id)
+
+    return live_data
+
+
+async def get_live_data_with_age(entity_id):
+    """Get live data like get_live_data, along with how old it is.
+
+    The age is None for fresh data, or the seconds since an expired copy
+    served while the API is slow or down was fetched.
+    """
+
+    key = ("live", entity_id)
+
+    live_data = entity_cache.get(key)
+    if live_data is not None:
+        return live_data, None
+
+    return await _get_within_budget(key, lambda: _fetch_live_data(entity_id))
+
+
+async def get_operating_hours(park_id):
+    """Get a park's upcoming operating windows from its schedule.
+
+    Returns a sorted list of `(opening, closing)` datetimes.
+    """
+
+    data = await get_entity(park_id, "schedule")
+
+    windows = []
+    for entry in data.get("schedule", ()):
+        if entry.get("type") not in ("OPERATING", "EXTRA_HOURS"):
+            continue
+
+        windows.append(
+            (
+                parse_time(entry["openingTime"]),
+                parse_time(entry["closingTime"]),
+            )
+        )
+
+    windows.sort()
+
+    return windows
+
+
+def get_fingerprint(entry):
+    """Get a value that changes whenever a live data entry does.
+
+    Uses the entry's lastUpdated time, or a hash of its contents if the
+    API didn't send one.
+    """
+
+    last_updated = entry.get("lastUpdated")
+    if last_updated is not None:
+        return last_updated
+
+    return hashlib.sha256(
+        json.dumps(entry, sort_keys=True).encode()
+    ).hexdigest()
+
+
+def parse_live_data(entry):
+    queue = entry.get("queue")
+
+    if queue is not None:
+        wait = queue.get("STANDBY", {}).get("waitTime")
+        return_time = parse_return_time(queue)
+    else:
+        wait = None
+        return_time = None
+
+    return LiveData(
+        id=entry["id"],
+        name=entry["name"],
+        status=entry["status"],
+        has_queue=queue is not None,
+        wait=wait,
+        return_time=return_time,
+        operating_hours=tuple(
+            OperatingHours(
+                type=hours["type"],
+                start=parse_time(hours["startTime"]),
+                end=parse_time(hours["endTime"]),
+            )
+            for hours in entry.get("operatingHours", ())
+        ),
+        forecast=tuple(
+            ForecastPoint(
+                time=parse_time(point["time"]), wait=point["waitTime"]
+            )
+            for point in entry.get("forecast", ())
+        ),
+    )
+
+
+def parse_return_time(queue):
+    """Parse a queue's free return time, or else its paid one."""
+
+    return_data = queue.get("RETURN_TIME", queue.get("PAID_RETURN_TIME"))
+    if return_data is None:
+        return None
+
+    start = return_data.get("returnStart")
+    price = return_data.get("price")
+
+    return ReturnTime(
+        state=return_data["state"],
+        start=parse_time(start) if start is not None else None,
+        price=price["amount"] if price is not None else None,
+        currency=price["currency"] if price is not None else None,
+    )
+
+
+def parse_time(value):
+    """Parse an ISO 8601 time from the API."""
+
+    try:
+        return dt.datetime.fromisoformat(value)
+    except ValueError:
+        # Anything fromisoformat doesn't cover takes the slow path
+        return parser.parse(value)
+
+
+async def get_catalog_destinations():
+    """Get destinations from the local catalog, fetching them if missing."""
+
+    destinations = catalog.get_destinations()
+
+    if destinations is None:
+        destinations = await get_destinations()
+        catalog.set_destinations(destinations)
+
+    return destinations
+
+
+async def get_park_children(park_id):
+    """Get a park's children from the local catalog, fetching if missing."""
+
+    children = catalog.get_children(park_id)
+
+    if children is None:
+        data = await get_entity(park_id, "children")
+        children = data["children"]
+        catalog.set_children(park_id, children)
+
+    return children
+
+
+async def refresh_catalog():
+    """Refresh stale parts of the local catalog and save it to disk.
+
+    Parks are refreshed one at a time so the refresh never bursts
+    requests at the API.
+    """
+
+    if (
+        catalog.get_destinations() is None
+        or catalog.destinations_age() > CATALOG_MAX_AGE
+    ):
+        # Fresh data only, so anything the API can't serve stays stale
+        # and is retried on the next refresh
+        catalog.set_destinations(await get_destinations(allow_stale=False))
+
+    stale_park_ids = catalog.get_stale_park_ids(CATALOG_MAX_AGE)
+
+    for i, park_id in enumerate(stale_park_ids, start=1):
+        data = await get_entity(park_id, "children", allow_stale=False)
+        catalog.set_children(park_id, data["children"])
+
+        if i % CATALOG_SAVE_BATCH == 0:
+            await save_catalog()
+
+    await save_catalog()
+
+
+async def save_catalog():
+    await asyncio.to_thread(catalog.save, catalog.snapshot())
+
+
+async def maintain_catalog():
+    """Keep the local catalog fresh in the background."""
+
+    while True:
+        try:
+            await refresh_catalog()
+        except Exception:
+            logging.exception("Failed to refresh the catalog")
+
+        await asyncio.sleep(CATALOG_REFRESH_INTERVAL)
+
+
+async def _get_within_budget(key, fetch, allow_stale=True):
+    """Await a fetch for a cache miss, serving an expired copy if it's slow.
+
+    Returns the data and its age, which is None unless an expired copy
+    was served. Without allow_stale, the fetch is waited on instead. The fetch, started by calling fetch(), is shared with
+    concurrent callers and keeps running in the background after they
+    stop waiting, so that it refreshes the cache.
+    """
+
+    task = _refreshes.start(key, fetch)
+
+    stale = entity_cache.get_stale(key) if allow_stale else None
+
+    # No point waiting on an API that's known to be failing
+    if stale is not None and breaker.is_open:
+        return stale
+
+    timeout = REQUEST_DEADLINE if stale is None else LATENCY_BUDGET
+
+    # Within a command, lookups share what's left of its deadline
+    ends_at = _deadline.get()
+    if ends_at is not None:
+        timeout = max(0, min(timeout, ends_at - time.monotonic()))
+
+    try:
+        data = await asyncio.wait_for(asyncio.shield(task), timeout)
+    except (ThemeParksError, asyncio.TimeoutError) as error:
+        if stale is None:
+            if isinstance(error, ThemeParksError):
+                raise
+
+            raise ThemeParksError(f"{key} didn't respond in time") from error
+
+        data, age = stale
+        logging.warning("Serving %s from %.0f seconds ago", key, age)
+
+        return data, age
+
+    return data, None
+
+
+async def _fetch_live_data(entity_id):
+    key = ("live", entity_id)
+
+    data = await _get_json(f"{API_URL}/entity/{entity_id}/live")
+
+    previous_records = live_records.get(entity_id, {})
+    records = {}
+    live_data = {}
+
+    for entry in data.get("liveData", ()):
+        fingerprint = get_fingerprint(entry)
+        record = previous_records.get(entry["id"])
+
+        if record is None or record[0] != fingerprint:
+            record = (fingerprint, parse_live_data(entry))
+
+        records[entry["id"]] = record
+        live_data[entry["id"]] = record[1]
+
+    live_records.set(entity_id, records, LIVE_RECORDS_TTL)
+    entity_cache.set(key, live_data, ENTITY_CACHE_TTLS["live"])
+
+    return live_data
+
+
+async def _get_json(url, cache_key=None, ttl=None):
+    """Get JSON from the API, sharing one request between concurrent callers.
+
+    Callers asking for a URL that is already being fetched await the
+    pending request instead of issuing their own.
+    """
+
+    return await _in_flight.run(url, lambda: _fetch_json(url, cache_key, ttl))
+
+
+async def _fetch_json(url, cache_key, ttl):
+    """Get JSON from the API within the rate limit, retrying failures.
+
+    Rate limiting and server errors are retried with jittered exponential
+    backoff, honoring any Retry-After header. URLs fetched before with an
+    ETag or Last-Modified are requested conditionally.
+    """
+
+    session = await get_session()
+
+    validators = validator_cache.get(url)
+    headers = {}
+
+    if validators is not None:
+        etag, last_modified, _, _ = validators
+
+        if etag is not None:
+            headers["If-None-Match"] = etag
+        if last_modified is not None:
+            headers["If-Modified-Since"] = last_modified
+
+    for attempt in range(MAX_RETRIES + 1):
+        if not breaker.allow():
+            raise ThemeParksError(f"{url} skipped while the API is failing")
+
+        try:
+            status, retry_after, body, response_headers = await _request(
+                session, url, headers
+            )
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exception:
+            retry_after = None
+            api_failing = True
+            error = ThemeParksError(
+                f"{url} failed: {type(exception).__name__}: {exception}"
+            )
+        else:
+            if body is not None:
+                breaker.record_success()
+                break
+
+            api_failing = status in BREAKER_STATUSES
+            error = ThemeParksError(f"{url} returned {status}")
+
+        if attempt == MAX_RETRIES:
+            if api_failing:
+                breaker.record_failure()
+
+            raise error
+
+        if retry_after is not None:
+            delay = retry_after
+            limiter.block_for(delay)
+        else:
+            delay = random.uniform(
+                0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt)
+            )
+
+        logging.warning("%s, retrying in %.1f seconds", error, delay)
+        await asyncio.sleep(delay)
+
+    if status == 304 and validators is not None:
+        # Unchanged, so the stored body is reused rather than parsed again
+        _, _, data, size = validators
+        validator_cache.set(url, validators, VALIDATOR_CACHE_TTL, size)
+    else:
+        try:
+            data = json.loads(body)
+        except ValueError as exception:
+            error = ThemeParksError(f"{url} returned invalid JSON")
+            raise error from exception
+
+        size = len(body)
+        etag = response_headers.get("ETag")
+        last_modified = response_headers.get("Last-Modified")
+
+        if status == 200 and (etag is not None or last_modified is not None):
+            validator_cache.set(
+                url,
+                (etag, last_modified, data, size),
+                VALIDATOR_CACHE_TTL,
+                size,
+            )
+
+    if cache_key is not None and status in (200, 304):
+        entity_cache.set(cache_key, data, ttl, size)
+
+    return data
+
+
+async def _request(session, url, headers=None):
+    """Make one rate-limited GET request.
+
+    Returns the status, the Retry-After delay, the body, which is None if
+    the request should be retried, and the response headers.
+    """
+
+    async with limiter:
+        async with session.get(url, headers=headers) as response:
+            if response.status in RETRY_STATUSES:
+                return (
+                    response.status,
+                    _get_retry_after(response),
+                    None,
+                    response.headers,
+                )
+
+            return (
+                response.status,
+                None,
+                await response.read(),
+                response.headers,
+            )
+
+
+def _get_retry_after(response):
+    """Get the delay in seconds requested by a Retry-After header."""
+
+    value = response.headers.get("Retry-After")
+
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+
+    return max(0.0, retry_at.timestamp() - time.time())
 
 
 async def search_for_entities(
-    session,
     query,
     destination_ids,
     park_query=None,
@@ -40,98 +681,84 @@ async def search_for_entities(
     Returns a list of matching entities.
     """
 
-    if destination_query is not None:
-        if park_query is not None:
-            parks = await search_for_parks(
-                session, park_query, destination_ids, destination_query
-            )
-        else:
-            parks = await search_for_parks(
-                session, "", destination_ids, destination_query
-            )
-    elif park_query is not None:
-        parks = await search_for_parks(session, park_query, destination_ids)
-    else:
-        parks = await search_for_parks(session, "", destination_ids)
+    if destination_query is None:
+        destination_query = ""
+
+    if park_query is None:
+        park_query = ""
 
     if entity_type is not None:
         entity_type = entity_type.upper()
 
+    destinations = await search_for_destinations(
+        destination_query, destination_ids
+    )
+
+    destination_parks = []
     tasks = []
-    for park in parks:
-        tasks.append(
-            asyncio.create_task(get_entity(session, park["id"], "children"))
-        )
+    for destination in destinations:
+        index = search_index.get_destination_index(destination)
+        parks = index.search_parks(park_query)
 
-    park_data = await asyncio.gather(*tasks)
+        destination_parks.append((destination, parks))
+        for park in parks:
+            tasks.append(asyncio.create_task(get_park_children(park["id"])))
 
-    query = query.strip().lower()
+    await asyncio.gather(*tasks)
 
     matches = []
 
-    for park in park_data:
-        for child in park["children"]:
-            if entity_type is not None and entity_type != child["entityType"]:
-                continue
+    for destination, parks in destination_parks:
+        if not parks:
+            continue
 
-            if query in child["name"].lower():
-                matches.append(child)
+        index = search_index.get_destination_index(destination)
+        matches.extend(
+            index.search_children(
+                query, {park["id"] for park in parks}, entity_type
+            )
+        )
 
     return matches
 
 
-async def search_for_destinations(session, query, destination_ids=None):
+async def search_for_destinations(query, destination_ids=None):
     """Search for a destination with the given queries and destination IDs.
 
     Returns a list of matching destinations.
     """
 
-    destinations = await get_destinations(session)
+    destinations = await get_catalog_destinations()
+    matches = search_index.search_destinations(destinations, query)
 
     if destination_ids is not None:
-        destinations_to_search = []
-
-        for destination in destinations:
-            if destination["id"] in destination_ids:
-                destinations_to_search.append(destination)
-    else:
-        destinations_to_search = destinations
-
-    query = query.strip().lower()
-
-    matches = []
-
-    for destination in destinations_to_search:
-        if query in destination["name"].lower():
-            matches.append(destination)
+        destination_ids = set(destination_ids)
+        matches = [
+            destination
+            for destination in matches
+            if destination["id"] in destination_ids
+        ]
 
     return matches
 
 
-async def search_for_parks(
-    session, query, destination_ids, destination_query=None
-):
+async def search_for_parks(query, destination_ids, destination_query=None):
     """Search for a park with the given queries and destination IDs.
 
     Returns a list of matching parks.
     """
 
-    if destination_query is not None:
-        destinations = await search_for_destinations(
-            session, destination_query, destination_ids
-        )
-    else:
-        destinations = await search_for_destinations(
-            session, "", destination_ids
-        )
+    if destination_query is None:
+        destination_query = ""
 
-    query = query.strip().lower()
+    destinations = await search_for_destinations(
+        destination_query, destination_ids
+    )
 
     matches = []
 
     for destination in destinations:
-        for park in destination["parks"]:
-            if query in park["name"].lower():
-                matches.append(park)
+        index = search_index.get_destination_index(destination)
+        matches.extend(index.search_parks(query))
 
     return matches
@@ -1,176 +1,416 @@
 import asyncio
+import datetime as dt
+import logging
 import os
-
-import aiohttp
-
+import time
 
 import helpers.database as db
 import helpers.embed as embed
+import helpers.notifications as notifications
 import helpers.themeparks as themeparks
+from helpers.scheduler import PollScheduler
 
+# Longest wait, in seconds, before newly tracked attractions are noticed
+TICK = 5
+# Seconds before opening and after closing that a park is still polled
+OPENING_LEAD = 10 * 60
+CLOSING_GRACE = 30 * 60
 
+scheduler = PollScheduler()
 
+# Live data and row state each attraction was last evaluated with, so
+# attractions where neither has changed skip evaluation
+_evaluated = {}
 
-async def track(client):
-    #channel = client.get_channel(STATUS_CHANNEL_ID)
+# Tracked rows and unique attractions seen in the most recent cycle, and
+# how many of the polled attractions had changed
+cycle_stats = {"rows": 0, "attractions": 0, "changed": 0, "unchanged": 0}
 
-    tracks = db.execute("SELECT * FROM tracks")
 
-    live_tasks = []
-    entity_tasks = []
+async def run(client):
+    """Track attractions forever, polling each one when it is due."""
 
-    async with aiohttp.ClientSession() as session:
-        for row in tracks:
-            live_tasks.append(
-                asyncio.create_task(
-                    themeparks.get_entity(
-                        session, row["attraction_id"], "live"
-                    )
-                )
-            )
-            entity_tasks.append(
-                asyncio.create_task(
-                    themeparks.get_entity(session, row["attraction_id"])
-                )
-            )
+    await client.wait_until_ready()
+
+    while True:
+        try:
+            await track(client)
+        except Exception:
+            logging.exception("Tracking cycle failed")
+
+        next_due = scheduler.next_due()
+        if next_due is None:
+            delay = TICK
+        else:
+            delay = min(TICK, max(0, next_due - time.time()))
+
+        await asyncio.sleep(delay)
+
+
+async def skip_closed_parks(attraction_ids, entities):
+    """Drop attractions whose park is closed, scheduling them for opening.
+
+    Returns the remaining attraction IDs and entities.
+    """
+
+    park_ids = set()
+    for entity in entities:
+        if "parkId" in entity:
+            park_ids.add(entity["parkId"])
+
+    hours_tasks = []
+    for park_id in park_ids:
+        hours_tasks.append(
+            asyncio.create_task(themeparks.get_operating_hours(park_id))
+        )
+
+    park_hours = {}
+    for park_id, hours in zip(
+        park_ids, await asyncio.gather(*hours_tasks, return_exceptions=True)
+    ):
+        # Without known hours the park is treated as open
+        if isinstance(hours, themeparks.ThemeParksError):
+            logging.warning("No hours for park %s: %s", park_id, hours)
+        elif isinstance(hours, BaseException):
+            raise hours
+        else:
+            park_hours[park_id] = hours
+
+    now = dt.datetime.now(dt.timezone.utc)
+
+    open_ids = []
+    open_entities = []
+
+    for attraction_id, entity in zip(attraction_ids, entities):
+        opening = get_next_opening(park_hours.get(entity.get("parkId")), now)
+
+        if opening is None:
+            open_ids.append(attraction_id)
+            open_entities.append(entity)
+        else:
+            scheduler.schedule_at(attraction_id, opening.timestamp())
+
+    return open_ids, open_entities
+
+
+def get_next_opening(windows, now):
+    """Get when a closed park should next be polled.
 
-        live_attractions = await asyncio.gather(*live_tasks)
-        entities = await asyncio.gather(*entity_tasks)
+    Returns None if the park is open, or if its hours are unknown.
+    """
 
-        park_tasks = []
-        destination_tasks = []
+    lead = dt.timedelta(seconds=OPENING_LEAD)
+    grace = dt.timedelta(seconds=CLOSING_GRACE)
 
-        for entity in entities:
-            park_tasks.append(
-                asyncio.create_task(embed.get_park(session, entity))
+    for opening, closing in windows or ():
+        if opening - lead <= now <= closing + grace:
+            return None
+
+        if opening - lead > now:
+            return opening - lead
+
+    return None
+
+
+async def get_live_data(attraction_ids, entities):
+    """Get the live data for each tracked attraction.
+
+    Attractions are grouped by park so each park's live data is fetched
+    once, falling back to the attraction's own live data when it has no
+    park or is missing from the park's feed. Attractions whose live data
+    couldn't be fetched, or is only available as an expired copy, get
+    None so alerts are never sent from out of date waits.
+    """
+
+    park_ids = set()
+    for entity in entities:
+        if "parkId" in entity:
+            park_ids.add(entity["parkId"])
+
+    park_tasks = []
+    for park_id in park_ids:
+        park_tasks.append(
+            asyncio.create_task(themeparks.get_live_data_with_age(park_id))
+        )
+
+    park_live_data = {}
+    # Parks the API is struggling with, whose attractions aren't retried
+    # one by one
+    failed_park_ids = set()
+
+    for park_id, result in zip(
+        park_ids, await asyncio.gather(*park_tasks, return_exceptions=True)
+    ):
+        if isinstance(result, themeparks.ThemeParksError):
+            logging.warning("No live data for park %s: %s", park_id, result)
+            failed_park_ids.add(park_id)
+        elif isinstance(result, BaseException):
+            raise result
+        elif result[1] is not None:
+            logging.warning("Live data for park %s is out of date", park_id)
+            failed_park_ids.add(park_id)
+        else:
+            park_live_data[park_id] = result[0]
+
+    live_attractions = []
+    missing = {}
+
+    for i, (attraction_id, entity) in enumerate(zip(attraction_ids, entities)):
+        park_id = entity.get("parkId")
+        live_data = park_live_data.get(park_id, {}).get(attraction_id)
+
+        if live_data is None and park_id not in failed_park_ids:
+            missing[i] = asyncio.create_task(
+                themeparks.get_live_data_with_age(attraction_id)
             )
-            destination_tasks.append(
-                asyncio.create_task(embed.get_destination(session, entity))
+
+        live_attractions.append(live_data)
+
+    for i, task in missing.items():
+        try:
+            live_data, age = await task
+        except themeparks.ThemeParksError as error:
+            logging.warning(
+                "No live data for attraction %s: %s", attraction_ids[i], error
             )
+            continue
+
+        if age is None:
+            live_attractions[i] = live_data.get(attraction_ids[i])
+
+    return live_attractions
+
+
+async def track(client):
+    tracks = await db.execute("SELECT * FROM tracks")
+    channel_tracks = await db.execute("SELECT * FROM channel_tracks")
+
+    # Every user and channel tracking the same attraction shares one fetch
+    # per cycle
+    attraction_rows = {}
+    for row in tracks + channel_tracks:
+        attraction_rows.setdefault(row["attraction_id"], []).append(row)
+
+    scheduler.sync(attraction_rows)
+    attraction_ids = scheduler.pop_due()
+
+    for attraction_id in _evaluated.keys() - attraction_rows.keys():
+        del _evaluated[attraction_id]
+
+    rows = sum(len(attraction_rows[id]) for id in attraction_ids)
+    cycle_stats["rows"] = rows
+    cycle_stats["attractions"] = len(attraction_ids)
+    logging.debug(
+        "Tracking %d unique attractions for %d tracked rows",
+        len(attraction_ids),
+        rows,
+    )
+
+    entity_tasks = []
 
-        parks = await asyncio.gather(*park_tasks)
-        destinations = await asyncio.gather(*destination_tasks)
+    for attraction_id in attraction_ids:
+        entity_tasks.append(
+            asyncio.create_task(themeparks.get_entity(attraction_id))
+        )
 
-    for row, attraction_data, entity, park, destination in zip(
-        tracks, live_attractions, entities, parks, destinations
+    fetched_ids = []
+    entities = []
+
+    for attraction_id, entity in zip(
+        attraction_ids,
+        await asyncio.gather(*entity_tasks, return_exceptions=True),
     ):
-        if "location" in entity:
-            place = f"{park['name']} - {destination['name']}"
-
-            location = entity["location"]
-            address = (
-                f"[{place}]"
-                "(https://www.google.com/maps/place/"
-                f"{location['latitude']},{location['longitude']})"
-            )
+        # Left unscheduled so the next cycle retries it
+        if isinstance(entity, themeparks.ThemeParksError):
+            logging.warning("No entity for %s: %s", attraction_id, entity)
+        elif isinstance(entity, BaseException):
+            raise entity
         else:
-            address = ""
-
-        live_data = attraction_data["liveData"][0]
-
-        status = live_data["status"]
-
-        if status == "OPERATING":
-            wait = live_data["queue"]["STANDBY"]["waitTime"]
-            threshold = row["wait_threshold"]
-
-            if row["reached_threshold"]:
-                if wait > threshold:
-                    status_embed = embed.create_embed(
-                        "Above threshold",
-                        f"**{live_data['name']}** is over your threshold.\n"
-                        + address,
-                    )
-                    status_embed.add_field(
-                        name="Wait time",
-                        value=f"`{wait}` minutes",
-                        inline=False,
-                    )
-                    status_embed.add_field(
-                        name="Threshold",
-                        value=f"`{threshold}` minutes",
-                        inline=False,
-                    )
-
-                    db.execute(
-                        "UPDATE tracks "
-                        "SET reached_threshold = 0 "
-                        "WHERE user_id = ? AND attraction_id = ?",
-                        row["user_id"],
-                        row["attraction_id"],
-                    )
-                    
-                    Id = row["user_id"]
-                    
-                    user = client.get_user(Id)
-                    await user.send(
-                        content=f"<@{row['user_id']}>", embed=status_embed
-                    )
-
-                    #await channel.
-            elif wait <= threshold:
+            fetched_ids.append(attraction_id)
+            entities.append(entity)
+
+    attraction_ids, entities = await skip_closed_parks(fetched_ids, entities)
+
+    live_attractions = await get_live_data(attraction_ids, entities)
+
+    changed_ids = []
+    changed_live_data = []
+    changed_entities = []
+
+    for attraction_id, live_data, entity in zip(
+        attraction_ids, live_attractions, entities
+    ):
+        # Left unscheduled so the next cycle retries it
+        if live_data is None:
+            continue
+
+        rows = attraction_rows[attraction_id]
+
+        scheduler.record_poll(
+            attraction_id,
+            live_data.status,
+            live_data.wait,
+            [row["wait_threshold"] for row in rows],
+        )
+
+        reached_thresholds = [row["reached_threshold"] for row in rows]
+        if _evaluated.get(attraction_id) == (
+            live_data,
+            get_rows_state(rows, reached_thresholds),
+        ):
+            continue
+
+        changed_ids.append(attraction_id)
+        changed_live_data.append(live_data)
+        changed_entities.append(entity)
+
+    polled = sum(live_data is not None for live_data in live_attractions)
+    cycle_stats["changed"] = len(changed_ids)
+    cycle_stats["unchanged"] = polled - len(changed_ids)
+    logging.debug(
+        "%d of %d polled attractions changed", len(changed_ids), polled
+    )
+
+    state_changes = []
+    channel_state_changes = []
+    # Each user's and channel's alerts for the cycle, sent together once
+    # it's evaluated
+    user_alerts = {}
+    channel_alerts = {}
+
+    parks, destinations = await embed.get_parents(changed_entities)
+
+    for attraction_id, live_data, entity, park, destination in zip(
+        changed_ids, changed_live_data, changed_entities, parks, destinations
+    ):
+        address = embed.create_address(
+            embed.create_place(entity, park, destination)
+        )
+
+        rows = attraction_rows[attraction_id]
+        reached_thresholds = []
+
+        for row in rows:
+            in_channel = "channel_id" in row
+            change = check_row(row, live_data, address, in_channel)
+            if change is None:
+                reached_thresholds.append(row["reached_threshold"])
+                continue
+
+            reached_threshold, status_embed = change
+            reached_thresholds.append(reached_threshold)
+
+            if in_channel:
+                channel_alerts.setdefault(row["channel_id"], []).append(
+                    status_embed
+                )
+                channel_state_changes.append(
+                    (reached_threshold, row["channel_id"], attraction_id)
+                )
+            else:
+                user_alerts.setdefault(row["user_id"], []).append(status_embed)
+                state_changes.append(
+                    (reached_threshold, row["user_id"], attraction_id)
+                )
+
+        _evaluated[attraction_id] = (
+            live_data,
+            get_rows_state(rows, reached_thresholds),
+        )
+
+    for user_id, alert_embeds in user_alerts.items():
+        await notifications.queue_alerts(user_id, alert_embeds)
+
+    for channel_id, alert_embeds in channel_alerts.items():
+        await notifications.queue_channel_alerts(channel_id, alert_embeds)
+
+    # Only written once the matching notifications have been queued
+    await save_state_changes(state_changes, channel_state_changes)
+
+
+def get_rows_state(rows, reached_thresholds):
+    """Get everything besides live data that evaluating rows depends on."""
+
+    return tuple(
+        ("channel_id" in row, row["id"], row["wait_threshold"], reached)
+        for row, reached in zip(rows, reached_thresholds)
+    )
+
+
+def check_row(row, live_data, address, in_channel=False):
+    """Check whether the attraction crossed the row's wait threshold.
+
+    Returns the row's new reached_threshold value and the embed to notify
+    the user or channel with, or None if nothing changed.
+    """
+
+    status = live_data.status
+    who, whose = (
+        ("This channel", "this channel's") if in_channel else ("You", "your")
+    )
+
+    if status == "OPERATING":
+        wait = live_data.wait
+        if wait is None:
+            return None
+
+        threshold = row["wait_threshold"]
+
+        if row["reached_threshold"]:
+            if wait > threshold:
                 status_embed = embed.create_embed(
-                    "Reached threshold!",
-                    f"**{live_data['name']}** "
-                    "has reached your threshold.\n" + address,
+                    "Above threshold",
+                    f"**{live_data.name}** is over {whose} threshold.\n"
+                    + address,
                 )
                 status_embed.add_field(
-                    name="Threshold",
-                    value=f"`{threshold}` minutes",
+                    name="Wait time",
+                    value=f"`{wait}` minutes",
                     inline=False,
                 )
                 status_embed.add_field(
-                    name="Wait time", value=f"`{wait}` minutes", inline=False
+                    name="Threshold",
+                    value=f"`{threshold}` minutes",
+                    inline=False,
                 )
 
-                db.execute(
-                    "UPDATE tracks "
-                    "SET reached_threshold = 1 "
-                    "WHERE user_id = ? AND attraction_id = ?",
-                    row["user_id"],
-                    row["attraction_id"],
-                )
-                
-                Id = row["user_id"]
-                    
-                user = client.get_user(Id)
-                await user.send(
-                    content=f"<@{row['user_id']}>", embed=status_embed
-                )
+                return 0, status_embed
+        elif wait <= threshold:
+            status_embed = embed.create_embed(
+                "Reached threshold!",
+                f"**{live_data.name}** "
+                f"has reached {whose} threshold.\n" + address,
+            )
+            status_embed.add_field(
+                name="Threshold",
+                value=f"`{threshold}` minutes",
+                inline=False,
+            )
+            status_embed.add_field(
+                name="Wait time", value=f"`{wait}` minutes", inline=False
+            )
 
+            return 1, status_embed
+    elif row["reached_threshold"]:
+        status_message = (
+            f"under {status.lower()}"
+            if status == "REFURBISHMENT"
+            else status.lower()
+        )
+        status_embed = embed.create_embed(
+            f"{live_data.name} is {status_message}.",
+            f"{address}\n"
+            f"{who} will be notified when the attraction is up "
+            f"and has reached {whose} threshold.",
+        )
 
-                #await channel.send(
-                #    content=f"<@{row['user_id']}>", embed=status_embed
-                #)
-        else:
-            if row["reached_threshold"]:
-                status_message = (
-                    f"under {status.lower()}"
-                    if status == "REFURBISHMENT"
-                    else status.lower()
-                )
-                status_embed = embed.create_embed(
-                    f"{live_data['name']} is {status_message}.",
-                    f"{address}\n"
-                    "You will be notified when the attraction is up "
-                    "and has reached your threshold.",
-                )
+        return 0, status_embed
 
-                db.execute(
-                    "UPDATE tracks "
-                    "SET reached_threshold = 0 "
-                    "WHERE user_id = ? AND attraction_id = ?",
-                    row["user_id"],
-                    row["attraction_id"],
-                )
-                
-                Id = row["user_id"]
-                    
-                user = client.get_user(Id)
-                await user.send(
-                    content=f"<@{row['user_id']}>", embed=status_embed
-                )
+    return None
+
+
+async def save_state_changes(state_changes, channel_state_changes):
+    """Write a cycle's reached_threshold changes in one transaction."""
 
-                #await channel.send(
-                #    content=f"<@{row['user_id']}>", embed=status_embed
-                #)
+    if state_changes or channel_state_changes:
+        await db.set_reached_thresholds(state_changes, channel_state_changes)